@@ -0,0 +1,15 @@
+'''
+Benchmark del proceso de revisión de contratos, sin llamar a los servicios de producción.
+
+Levanta un servicio local que imita ENDPOINT_1, ENDPOINT_2 y ENDPOINT_3 (con latencia,
+errores y respuestas JSON en vez del PDF configurables), genera una lista sintética de
+comercios y sus contratos, y mide process_block y main de punta a punta. Se ejecuta
+desde la raíz del repositorio:
+
+    python -m benchmark.run_benchmark --rows 1000 --max-workers 8 --batch-size 32
+
+Para validar que un backend de embeddings (EMBEDDING_BACKEND) entrega los mismos
+coeficientes que el actual, dentro de una tolerancia, sobre una muestra de contratos:
+
+    python -m benchmark.backend_parity --backend onnx-int8 --corpus muestras/ --tolerance 0.02
+'''
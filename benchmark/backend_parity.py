@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from benchmark.synthetic import contract_pdf, example_pdf, other_document_pdf, random_rut
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compara los coeficientes de similitud de un backend de embeddings con los del backend de referencia"
+    )
+    parser.add_argument("--backend", required=True, help="backend a validar (por ejemplo onnx-int8)")
+    parser.add_argument("--reference-backend", default="torch", help="backend de referencia")
+    parser.add_argument("--model", help="modelo (por defecto MODEL_NAME, o all-MiniLM-L6-v2)")
+    parser.add_argument("--corpus", help="directorio con contratos PDF de muestra (por defecto, contratos sintéticos)")
+    parser.add_argument("--samples", type=int, default=50, help="cantidad de documentos sintéticos")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="diferencia máxima aceptada por documento")
+    parser.add_argument("--threads", type=int, help="hilos de cálculo de cada backend (EMBEDDING_THREADS)")
+    parser.add_argument("--onnx-file", help="archivo .onnx a usar (EMBEDDING_ONNX_FILE)")
+    return parser.parse_args(argv)
+
+
+def sample_corpus(args):
+    '''
+    Documentos de muestra: los PDF del directorio indicado o, si no hay, contratos sintéticos
+    mezclados con algunos documentos que no son contratos.
+    '''
+    if args.corpus:
+        names = sorted(name for name in os.listdir(args.corpus) if name.lower().endswith(".pdf"))
+        files = []
+        for name in names:
+            with open(os.path.join(args.corpus, name), "rb") as f:
+                files.append(f.read())
+        return files
+
+    import random
+
+    rng = random.Random(0)
+    files = []
+    for position in range(args.samples):
+        comercio_id = random_rut(rng)
+        files.append(other_document_pdf(comercio_id) if position % 5 == 4 else contract_pdf(comercio_id))
+    return files
+
+
+def score(backend, args, example_file, template_paths, files):
+    '''
+    Coeficientes de cada documento con un backend, y el tiempo que tomó calcularlos.
+    '''
+    from compare import FileCompare
+
+    compare = FileCompare(
+        example_file,
+        use_embeddings=True,
+        model_name=args.model,
+        template_paths=template_paths,
+        embedding_backend=backend,
+        embedding_threads=args.threads,
+        onnx_file=args.onnx_file if backend.startswith("onnx") else None
+    )
+    compare.load_references()
+
+    start = time.perf_counter()
+    scores = compare.compare_batch_to_example(files)
+    elapsed = time.perf_counter() - start
+    return np.array([np.nan if value is None else value for value in scores]), elapsed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    os.environ.setdefault("QUIET", "1")
+    args.model = args.model or os.getenv("MODEL_NAME") or "all-MiniLM-L6-v2"
+
+    # Plantillas: las configuradas para el proceso, o el contrato de ejemplo sintético
+    from compare import template_files
+
+    example_file = os.getenv("EXAMPLE_FILE")
+    templates_dir = os.getenv("TEMPLATES_DIR")
+    template_paths = template_files(templates_dir) if templates_dir else None
+    if not example_file and not template_paths:
+        example_file = os.path.join(tempfile.mkdtemp(prefix="parity_"), "ejemplo.pdf")
+        with open(example_file, "wb") as f:
+            f.write(example_pdf())
+
+    files = sample_corpus(args)
+    reference, reference_time = score(args.reference_backend, args, example_file, template_paths, files)
+    candidate, candidate_time = score(args.backend, args, example_file, template_paths, files)
+
+    differences = np.abs(reference - candidate)
+    valid = ~np.isnan(differences)
+    worst = float(differences[valid].max()) if valid.any() else 0.0
+
+    print(f"Documentos: {len(files)} (comparables: {int(valid.sum())}), modelo: {args.model}")
+    print(f"{args.reference_backend}: {reference_time:.2f} s, {args.backend}: {candidate_time:.2f} s "
+          f"({reference_time / candidate_time if candidate_time else float('nan'):.2f}x)")
+    print(f"Diferencia media: {float(differences[valid].mean()) if valid.any() else 0.0:.4f}, "
+          f"máxima: {worst:.4f}, tolerancia: {args.tolerance}")
+
+    outside = np.flatnonzero(valid & (differences > args.tolerance))
+    for position in outside:
+        print(f"  documento {position}: {reference[position]:.4f} vs {candidate[position]:.4f}")
+
+    if outside.size:
+        print(f"El backend {args.backend} NO está dentro de la tolerancia ({outside.size} documentos fuera)")
+        sys.exit(1)
+    print(f"El backend {args.backend} está dentro de la tolerancia")
+
+
+if __name__ == "__main__":
+    main()
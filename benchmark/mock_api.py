@@ -0,0 +1,242 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional
+
+from benchmark.synthetic import contract_pdf, other_document_pdf
+
+# Rutas de cada servicio simulado (equivalentes a ENDPOINT_1, ENDPOINT_2 y ENDPOINT_3)
+FILES_PATH = "/documents/files/"
+CONTRACT_PATH = "/documents/contract/operator/klap"
+DOWNLOAD_PATH = "/documents/download/"
+
+
+class MockContractAPI():
+    '''
+    Servidor HTTP local que imita los servicios de contratos, para medir el proceso sin
+    llamar a producción:
+
+    - GET  ENDPOINT_1/<comercio>: lista de documentos (incluye "CONTRATOS" si existe).
+    - POST ENDPOINT_1<comercio> y ENDPOINT_3<comercio>: descarga del archivo del contrato.
+    - POST ENDPOINT_2 con {"commerceRut": ...}: creación del contrato.
+
+    Cada respuesta se demora latency segundos (± jitter). Con probabilidad error_rate
+    se responde 503, con json_error_rate la descarga responde un error JSON en vez del PDF,
+    y con create_failure_rate la creación falla. Con other_document_rate el archivo
+    descargado no es un contrato (para ejercitar el caso de baja similitud).
+    '''
+
+    def __init__(
+        self,
+        existing: Iterable[str] = (),
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        json_error_rate: float = 0.0,
+        create_failure_rate: float = 0.0,
+        other_document_rate: float = 0.0,
+        pages: int = 3,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.json_error_rate = json_error_rate
+        self.create_failure_rate = create_failure_rate
+        self.other_document_rate = other_document_rate
+        self.pages = pages
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._contracts = set(str(comercio_id) for comercio_id in existing)
+        self._files: Dict[str, bytes] = {}
+        self.requests = Counter()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def endpoints(self) -> Dict[str, str]:
+        '''
+        Variables de ambiente ENDPOINT_1, ENDPOINT_2 y ENDPOINT_3 apuntando al servidor local.
+        '''
+        return {
+            "ENDPOINT_1": self.base_url + FILES_PATH,
+            "ENDPOINT_2": self.base_url + CONTRACT_PATH,
+            "ENDPOINT_3": self.base_url + DOWNLOAD_PATH
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-contract-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _chance(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def _delay(self):
+        if self.latency <= 0 and self.jitter <= 0:
+            return
+        with self._lock:
+            seconds = self._random.uniform(self.latency - self.jitter, self.latency + self.jitter)
+        time.sleep(max(0.0, seconds))
+
+    def _count(self, name: str):
+        with self._lock:
+            self.requests[name] += 1
+
+    def has_contract(self, comercio_id: str) -> bool:
+        with self._lock:
+            return comercio_id in self._contracts
+
+    def listing(self, comercio_id: str) -> list:
+        documents = [{
+            "codigoDocumento": "002",
+            "nombreDocumento": "CEDULA",
+            "nombreArchivo": f"{comercio_id}_002.pdf",
+            "estado": "APROBADO"
+        }]
+        if self.has_contract(comercio_id):
+            documents.append({
+                "codigoDocumento": "001",
+                "nombreDocumento": "CONTRATOS",
+                "nombreArchivo": f"{comercio_id}_001.pdf",
+                "path": "/mock",
+                "estado": "APROBADO",
+                "file": None
+            })
+        return documents
+
+    def contract_file(self, comercio_id: str) -> bytes:
+        '''
+        Archivo del contrato de un comercio, generado en el primer pedido y reutilizado después.
+        '''
+        with self._lock:
+            file = self._files.get(comercio_id)
+        if file is not None:
+            return file
+
+        if self._chance(self.other_document_rate):
+            file = other_document_pdf(comercio_id)
+        else:
+            file = contract_pdf(comercio_id, pages=self.pages)
+        with self._lock:
+            return self._files.setdefault(comercio_id, file)
+
+    def create(self, comercio_id: str) -> bool:
+        if self._chance(self.create_failure_rate):
+            return False
+        with self._lock:
+            self._contracts.add(comercio_id)
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Sin Nagle, para que la latencia medida sea solo la configurada
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status, data):
+                self._send(status, json.dumps(data).encode("utf-8"), "application/json")
+
+            def _read_body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _comercio_id(self, prefix):
+                return self.path[len(prefix):].strip("/")
+
+            def _start(self, name) -> bool:
+                '''
+                Registra el pedido, aplica la latencia y, si corresponde, responde un error
+                del servicio. Retorna False si ya se respondió.
+                '''
+                api._count(name)
+                api._delay()
+                if api._chance(api.error_rate):
+                    api._count(f"{name}_error")
+                    self._send_json(503, {"message": "Servicio no disponible", "status_code": 503})
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self.path.startswith(FILES_PATH):
+                    self._send_json(404, {"message": "Ruta no encontrada", "status_code": 404})
+                    return
+                if self._start("listing"):
+                    self._send_json(200, api.listing(self._comercio_id(FILES_PATH)))
+
+            def do_POST(self):
+                body = self._read_body()
+
+                if self.path.startswith(CONTRACT_PATH):
+                    if not self._start("create"):
+                        return
+                    try:
+                        comercio_id = str(json.loads(body)["commerceRut"])
+                    except (ValueError, KeyError, TypeError):
+                        self._send_json(400, {"message": "Solicitud inválida", "status_code": 400})
+                        return
+                    if api.create(comercio_id):
+                        self._send_json(200, {"message": "Contrato creado"})
+                    else:
+                        api._count("create_failed")
+                        self._send_json(500, {"message": "No fue posible crear el contrato", "status_code": 500})
+
+                elif self.path.startswith(FILES_PATH) or self.path.startswith(DOWNLOAD_PATH):
+                    prefix = FILES_PATH if self.path.startswith(FILES_PATH) else DOWNLOAD_PATH
+                    if not self._start("download"):
+                        return
+                    comercio_id = self._comercio_id(prefix)
+                    if not api.has_contract(comercio_id):
+                        self._send_json(404, {"message": "Archivo no encontrado", "status_code": 404})
+                    elif api._chance(api.json_error_rate):
+                        # El servicio real a veces responde 200 con un error JSON en vez del
+                        # archivo, y no siempre con el Content-Type que corresponde
+                        api._count("download_json_error")
+                        body = json.dumps({"message": "Archivo no encontrado", "status_code": 404}).encode("utf-8")
+                        self._send(200, body, "application/json" if api._chance(0.5) else "application/pdf")
+                    else:
+                        self._send(200, api.contract_file(comercio_id), "application/pdf")
+
+                else:
+                    self._send_json(404, {"message": "Ruta no encontrada", "status_code": 404})
+
+        return Handler
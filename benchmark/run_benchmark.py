@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmark.mock_api import MockContractAPI
+from benchmark.synthetic import example_pdf, merchant_sheet, write_sheet
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark del proceso de revisión de contratos contra un servicio simulado local"
+    )
+    parser.add_argument("--mode", choices=("block", "main", "both"), default="both",
+                        help="medir process_block directamente, main de punta a punta, o ambos")
+    parser.add_argument("--rows", type=int, default=500, help="filas de la lista sintética de comercios")
+    parser.add_argument("--format", choices=("xlsx", "csv", "parquet"), default="xlsx",
+                        help="formato del archivo de entrada para main")
+    parser.add_argument("--block-size", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=10000, help="filas por trozo (entradas CSV o Parquet)")
+    parser.add_argument("--max-workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=0, help="tamaño de lote de embeddings (0 = uno por uno)")
+    parser.add_argument("--pages", type=int, default=3, help="páginas de cada contrato sintético")
+    parser.add_argument("--regularized-rate", type=float, default=0.5, help="fracción de filas ya marcadas con contrato")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="fracción de filas con un ID repetido")
+    parser.add_argument("--mistyped-rate", type=float, default=0.5,
+                        help="fracción de comercios sin contrato declarado que sí lo tienen en el servicio")
+    parser.add_argument("--latency", type=float, default=0.02, help="latencia media de cada respuesta, en segundos")
+    parser.add_argument("--jitter", type=float, default=0.01, help="variación de la latencia, en segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de respuestas 503")
+    parser.add_argument("--json-error-rate", type=float, default=0.0,
+                        help="fracción de descargas que responden un error JSON en vez del PDF")
+    parser.add_argument("--create-failure-rate", type=float, default=0.1, help="fracción de creaciones que fallan")
+    parser.add_argument("--other-document-rate", type=float, default=0.05,
+                        help="fracción de archivos descargados que no son contratos")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="medir el pico de memoria de Python con tracemalloc (más lento)")
+    parser.add_argument("--no-warm-up", action="store_true",
+                        help="incluir la carga del modelo en el tiempo medido")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directorio para los archivos generados (por defecto, uno temporal)")
+    parser.add_argument("--report", help="archivo JSON donde guardar los resultados")
+    return parser.parse_args(argv)
+
+
+def create_api(args, df):
+    '''
+    Crea el servicio simulado (se inicia al entrar al bloque with). Una fracción de los
+    comercios sin contrato declarado ya tiene su contrato en el servicio (casos mal
+    clasificados); el resto se debe reparar.
+    '''
+    import random
+
+    rng = random.Random(args.seed)
+    undeclared = df.loc[df["Contrato"] != "Si", "Comercio"].unique()
+    existing = [comercio_id for comercio_id in undeclared if rng.random() < args.mistyped_rate]
+
+    api = MockContractAPI(
+        existing=existing,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        json_error_rate=args.json_error_rate,
+        create_failure_rate=args.create_failure_rate,
+        other_document_rate=args.other_document_rate,
+        pages=args.pages,
+        seed=args.seed
+    )
+    os.environ.update(api.endpoints)
+    return api
+
+
+def peak_rss_mb():
+    '''
+    Pico de memoria residente del proceso y de sus procesos hijos (pool de extracción), en MB.
+    En Linux ru_maxrss está en KB. Es un máximo desde el inicio del proceso, no por corrida.
+    '''
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return own / scale, children / scale
+
+
+def measure(name, args, api, run):
+    '''
+    Ejecuta run() con métricas nuevas y retorna filas por segundo, latencia por etapa,
+    pedidos al servicio y pico de memoria.
+    '''
+    from metrics import reset_metrics
+
+    metrics = reset_metrics()
+    if args.trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+
+    python_peak = None
+    if args.trace_memory:
+        python_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    snapshot = metrics.snapshot()
+    rss, children_rss = peak_rss_mb()
+    return {
+        "name": name,
+        "elapsed_seconds": elapsed,
+        "rows": snapshot["rows"],
+        "rows_per_second": snapshot["rows"] / elapsed if elapsed > 0 else 0.0,
+        "merchants": snapshot["merchants"],
+        "merchants_per_second": snapshot["merchants"] / elapsed if elapsed > 0 else 0.0,
+        "max_in_flight": snapshot["max_in_flight"],
+        "stages": snapshot["stages"],
+        "requests": dict(api.requests),
+        "peak_python_mb": python_peak,
+        "peak_rss_mb": rss,
+        "peak_children_rss_mb": children_rss
+    }
+
+
+def run_block(args, workdir, df):
+    '''
+    Mide process_block directamente sobre la lista en memoria, bloque por bloque.
+    '''
+    import correccion_contratos
+    from compare import shutdown
+    from http_client import close_sessions
+    from input_files import prepare_chunk
+
+    df = prepare_chunk(df.copy())
+    log_file = os.path.join(workdir, "block.log")
+    open(log_file, "w").close()
+
+    headers = {"Authorization": "Bearer benchmark"}
+
+    def run():
+        for start in range(0, len(df), args.block_size):
+            end = min(start + args.block_size, len(df))
+            correccion_contratos.process_block(
+                df, start, end,
+                os.environ["ENDPOINT_1"], os.environ["ENDPOINT_2"], headers, headers,
+                log_file, args.block_size, args.max_workers, args.batch_size
+            )
+        close_sessions()
+        shutdown()
+
+    with create_api(args, df) as api:
+        return measure("process_block", args, api, run)
+
+
+def run_main(args, workdir, df):
+    '''
+    Mide main de punta a punta (lectura, proceso, journal y escritura de la salida), sin preguntas.
+    '''
+    import correccion_contratos
+
+    file_name = os.path.join(workdir, f"comercios.{args.format}")
+    write_sheet(df, file_name)
+    os.environ.update({
+        "FILE_NAME": file_name,
+        "OUTPUT_FILE": os.path.join(workdir, f"comercios_resultado.{args.format}"),
+        "LOG_FILE": os.path.join(workdir, "main.log"),
+        "JOURNAL_FILE": os.path.join(workdir, "main.journal.jsonl"),
+        "BLOCK_SIZE": str(args.block_size),
+        "CHUNK_SIZE": str(args.chunk_size)
+    })
+
+    with create_api(args, df) as api:
+        return measure("main", args, api, lambda: correccion_contratos.main(["--no-prompt"]))
+
+
+def print_report(result):
+    print(f"\n== {result['name']} ==")
+    print(f"Filas: {result['rows']}, tiempo: {result['elapsed_seconds']:.2f} s, "
+          f"filas por segundo: {result['rows_per_second']:.2f}, comercios por segundo: {result['merchants_per_second']:.2f}")
+    print(f"Máximo en paralelo: {result['max_in_flight']}, pedidos al servicio: {result['requests']}")
+
+    print(f"{'etapa':<20}{'n':>8}{'media':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, stats in sorted(result["stages"].items()):
+        values = [stats[key] or 0.0 for key in ("mean", "p50", "p90", "p99", "max")]
+        print(f"{name:<20}{stats['count']:>8}" + "".join(f"{value * 1000:>8.1f}ms" for value in values))
+
+    memory = f"Pico de memoria: RSS {result['peak_rss_mb']:.1f} MB, hijos {result['peak_children_rss_mb']:.1f} MB"
+    if result["peak_python_mb"] is not None:
+        memory += f", Python (tracemalloc) {result['peak_python_mb']:.1f} MB"
+    print(memory)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark_contratos_")
+    os.makedirs(workdir, exist_ok=True)
+
+    # Configuración del proceso apuntando a archivos locales. Las variables que ya estén
+    # definidas (por ejemplo MODEL_NAME o CASCADE_*) se respetan
+    example_file = os.path.join(workdir, "ejemplo.pdf")
+    with open(example_file, "wb") as f:
+        f.write(example_pdf(args.pages))
+    os.environ.update({
+        "EXAMPLE_FILE": example_file,
+        "TOKEN_1": "benchmark",
+        "TOKEN_2": "benchmark",
+        "MAX_WORKERS": str(args.max_workers),
+        "EMBEDDING_BATCH_SIZE": str(args.batch_size)
+    })
+    os.environ.setdefault("QUIET", "1")
+    os.environ.setdefault("CONTRACT_CACHE_DIR", "")
+
+    df = merchant_sheet(args.rows, args.regularized_rate, args.duplicate_rate, args.seed)
+    report = {"arguments": vars(args), "runs": []}
+
+    # Cargar el modelo antes de medir, para comparar el proceso en régimen
+    if not args.no_warm_up:
+        from compare import get_instance
+
+        start = time.perf_counter()
+        get_instance().load_references()
+        report["model_load_seconds"] = time.perf_counter() - start
+        print(f"Modelo cargado en {report['model_load_seconds']:.2f} s")
+
+    if args.mode in ("block", "both"):
+        report["runs"].append(run_block(args, workdir, df))
+        print_report(report["runs"][-1])
+    if args.mode in ("main", "both"):
+        report["runs"].append(run_main(args, workdir, df))
+        print_report(report["runs"][-1])
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(f"\nArchivos generados en {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import random
+import zlib
+from typing import List, Optional
+import pandas as pd
+
+# Cláusulas base de los contratos sintéticos. Cada contrato usa todas, en orden, con
+# pequeñas variaciones por comercio, para que se parezca al ejemplo sin ser idéntico
+CONTRACT_CLAUSES = [
+    "CONTRATO DE AFILIACION AL SISTEMA DE PAGOS",
+    "En Santiago de Chile, entre la empresa operadora y el comercio {nombre}, RUT {rut}, se acuerda lo siguiente.",
+    "PRIMERO: El comercio se afilia al sistema de pagos con tarjetas de debito, credito y prepago.",
+    "SEGUNDO: La operadora procesara las transacciones y abonara los montos en la cuenta informada por el comercio.",
+    "TERCERO: El comercio pagara las comisiones indicadas en el anexo de tarifas vigente a la fecha de firma.",
+    "CUARTO: El comercio debera mantener la documentacion de respaldo de cada transaccion por un plazo de cinco anos.",
+    "QUINTO: Cualquiera de las partes podra poner termino al contrato con un aviso previo de treinta dias.",
+    "SEXTO: Las partes fijan domicilio en la ciudad de Santiago y se someten a la jurisdiccion de sus tribunales.",
+    "Firmado por el representante legal de {nombre} con fecha {fecha}."
+]
+
+# Texto de un documento que no es contrato (por ejemplo, un archivo mal cargado)
+OTHER_DOCUMENT_LINES = [
+    "CEDULA DE IDENTIDAD",
+    "Nombre: {nombre}",
+    "RUN: {rut}",
+    "Fecha de emision: {fecha}",
+    "Documento valido para acreditar identidad ante instituciones publicas y privadas."
+]
+
+NAMES = ["Almacen", "Botilleria", "Ferreteria", "Panaderia", "Minimarket", "Farmacia", "Libreria", "Verduleria"]
+
+
+def rut_check_digit(number: int) -> str:
+    '''
+    Dígito verificador de un RUT (módulo 11).
+    '''
+    total = 0
+    factor = 2
+    for digit in reversed(str(number)):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    remainder = 11 - total % 11
+    return {11: "0", 10: "K"}.get(remainder, str(remainder))
+
+
+def random_rut(rng: random.Random) -> str:
+    number = rng.randint(5_000_000, 29_999_999)
+    return f"{number}-{rut_check_digit(number)}"
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    '''
+    Genera un PDF mínimo (Helvetica, sin dependencias) con una página por lista de líneas.
+    El texto se puede extraer con PyPDF2 como el de un contrato real.
+    '''
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+
+    for lines in pages:
+        commands = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in lines:
+            commands.append(f"({_escape(line)}) Tj T*")
+        commands.append("ET")
+        stream = zlib.compress("\n".join(commands).encode("latin-1", errors="replace"))
+
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" /Filter /FlateDecode >>\nstream\n" + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        page_ids.append(len(objects))
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(output)
+
+
+def _paginate(lines: List[str], pages: int) -> List[List[str]]:
+    per_page = max(1, -(-len(lines) // pages))
+    return [lines[position:position + per_page] for position in range(0, len(lines), per_page)]
+
+
+def contract_pdf(comercio_id: str, pages: int = 3, seed: Optional[int] = None, repeat: int = 4) -> bytes:
+    '''
+    Contrato sintético de un comercio: las cláusulas base, repetidas repeat veces para
+    darle un largo realista, con el nombre, la fecha y algunas palabras variando por comercio.
+    '''
+    rng = random.Random(seed if seed is not None else comercio_id)
+    values = {
+        "nombre": f"{rng.choice(NAMES)} {comercio_id.split('-')[0][-4:]}",
+        "rut": comercio_id,
+        "fecha": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-20{rng.randint(15, 25)}"
+    }
+
+    lines = []
+    for _ in range(repeat):
+        for clause in CONTRACT_CLAUSES:
+            line = clause.format(**values)
+            # Variación menor: omitir alguna palabra de vez en cuando
+            if rng.random() < 0.2:
+                words = line.split()
+                del words[rng.randrange(len(words))]
+                line = " ".join(words)
+            lines.append(line)
+    return make_pdf(_paginate(lines, pages))
+
+
+def other_document_pdf(comercio_id: str, seed: Optional[int] = None) -> bytes:
+    '''
+    Documento sintético que no es un contrato (debería tener baja similitud con el ejemplo).
+    '''
+    rng = random.Random(seed if seed is not None else comercio_id)
+    values = {"nombre": rng.choice(NAMES), "rut": comercio_id, "fecha": "01-01-2020"}
+    return make_pdf([[line.format(**values) for line in OTHER_DOCUMENT_LINES]])
+
+
+def example_pdf(pages: int = 3) -> bytes:
+    '''
+    Contrato de ejemplo contra el que se comparan los demás (sin variaciones).
+    '''
+    values = {"nombre": "COMERCIO DE EJEMPLO", "rut": "11111111-1", "fecha": "01-01-2024"}
+    lines = [clause.format(**values) for _ in range(4) for clause in CONTRACT_CLAUSES]
+    return make_pdf(_paginate(lines, pages))
+
+
+def merchant_sheet(rows: int, regularized_rate: float = 0.5, duplicate_rate: float = 0.05, seed: int = 0) -> pd.DataFrame:
+    '''
+    Lista sintética de comercios con las columnas del archivo de entrada ("Comercio" y
+    "Contrato"). Una fracción regularized_rate ya viene marcada con contrato ("Si"), y
+    una fracción duplicate_rate repite el ID de una fila anterior.
+    '''
+    rng = random.Random(seed)
+    comercios = []
+    for _ in range(rows):
+        if comercios and rng.random() < duplicate_rate:
+            comercios.append(rng.choice(comercios))
+        else:
+            comercios.append(random_rut(rng))
+
+    contratos = ["Si" if rng.random() < regularized_rate else "No" for _ in range(rows)]
+    return pd.DataFrame({"Comercio": comercios, "Contrato": contratos})
+
+
+def write_sheet(df: pd.DataFrame, file_name: str):
+    '''
+    Escribe la lista de comercios en el formato que indique la extensión (xlsx, csv o parquet).
+    '''
+    if file_name.endswith(".csv"):
+        df.to_csv(file_name, index=False)
+    elif file_name.endswith(".parquet"):
+        df.to_parquet(file_name, index=False)
+    else:
+        df.to_excel(file_name, index=False)
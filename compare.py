@@ -1,31 +1,229 @@
 import difflib
 import base64
+import hashlib
+import mmap
+import multiprocessing
 import os
-from typing import Optional
+import threading
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
 from dotenv import load_dotenv
 from io import BytesIO
-from PyPDF2 import PdfReader
-from sentence_transformers import SentenceTransformer, util
+from contract_cache import ContractCache, get_contract_cache
+from embedding_backends import load_embedding_model
+from metrics import get_metrics, show
+from near_duplicates import NearDuplicateIndex
+
+class Similarity(NamedTuple):
+    '''
+    Resultado de comparar un documento con el ejemplo: el coeficiente, el nivel
+    de la cascada que lo decidió ("lexico", "embedding", "secciones", o "duplicado" si se
+    reutilizó el de un documento casi idéntico) y la plantilla de contrato con la que
+    obtuvo ese coeficiente (la más parecida, si hay varias).
+    '''
+    score: float
+    tier: Optional[str]
+    template: Optional[str] = None
+
+
+# Resultado usado cuando no fue posible comparar el documento
+NO_SIMILARITY = Similarity(0.0, None)
+
+
+def pdf_stream(file_bytes):
+    '''
+    Stream de lectura para un archivo PDF. Un archivo mapeado en memoria (descargas grandes)
+    se lee directamente, sin copiarlo a un BytesIO.
+    '''
+    if isinstance(file_bytes, mmap.mmap):
+        file_bytes.seek(0)
+        return file_bytes
+    return BytesIO(file_bytes)
+
+
+def extract_pdf_text(file_bytes, max_pages=None, max_chars=None):
+    '''
+    Convertir un archivo PDF (en stream de bytes) a texto, leyendo como máximo max_pages
+    páginas y max_chars caracteres (None = sin límite). Las páginas se juntan al final,
+    en tiempo lineal. Es una función de módulo para poder ejecutarla en un pool de procesos.
+    '''
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_stream(file_bytes))
+    pages = []
+    length = 0
+    for number, page in enumerate(reader.pages):
+        if max_pages is not None and number >= max_pages:
+            break
+        page_text = page.extract_text() or ""
+        pages.append(page_text)
+        length += len(page_text)
+        if max_chars is not None and length >= max_chars:
+            break
+
+    text = "".join(pages)
+    return text[:max_chars] if max_chars is not None else text
+
+
+def split_sections(text, section_chars):
+    '''
+    Divide un texto en secciones consecutivas de section_chars caracteres.
+    '''
+    return [
+        text[position:position + section_chars]
+        for position in range(0, len(text), section_chars)
+        if text[position:position + section_chars].strip()
+    ]
+
+
+def iter_pdf_sections(file_bytes, section_chars, max_pages=None, max_chars=None):
+    '''
+    Recorre el texto de un archivo PDF en secciones de section_chars caracteres (las
+    mismas que split_sections sobre extract_pdf_text), leyendo las páginas recién a
+    medida que se piden secciones. Si se deja de iterar, el resto del archivo no se lee.
+    '''
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(pdf_stream(file_bytes))
+    buffer = ""
+    length = 0
+    for number, page in enumerate(reader.pages):
+        if max_pages is not None and number >= max_pages:
+            break
+        page_text = page.extract_text() or ""
+        if max_chars is not None:
+            page_text = page_text[:max_chars - length]
+        length += len(page_text)
+        buffer += page_text
+
+        while len(buffer) >= section_chars:
+            section, buffer = buffer[:section_chars], buffer[section_chars:]
+            if section.strip():
+                yield section
+        if max_chars is not None and length >= max_chars:
+            break
+
+    if buffer.strip():
+        yield buffer
+
+
+def template_files(directory: str) -> List[str]:
+    '''
+    Archivos PDF de un directorio de plantillas de contrato, en orden alfabético.
+    '''
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(".pdf")
+    )
+
 
 class FileCompare():
 
     def __init__(
         self,
-        model_file_path: str,
+        model_file_path: Optional[str],
         use_embeddings: bool = False,
-        model_name: str = "all-MiniLM-L6-v2"
+        model_name: str = "all-MiniLM-L6-v2",
+        cache_dir: Optional[str] = None,
+        contract_cache: Optional[ContractCache] = None,
+        cascade_accept: Optional[float] = None,
+        cascade_reject: Optional[float] = None,
+        cascade_method: str = "jaccard",
+        cascade_sample_size: int = 5000,
+        pdf_workers: int = 0,
+        pdf_max_pages: Optional[int] = None,
+        pdf_max_chars: Optional[int] = None,
+        template_paths: Optional[List[str]] = None,
+        section_accept: Optional[float] = None,
+        section_chars: int = 1000,
+        section_min: int = 2,
+        section_batch: int = 2,
+        embedding_backend: str = "torch",
+        embedding_threads: Optional[int] = None,
+        onnx_file: Optional[str] = None,
+        near_duplicate_threshold: Optional[float] = None,
+        near_duplicate_bands: int = 32,
+        near_duplicate_rows: int = 4,
+        near_duplicate_shingle: int = 5,
+        near_duplicate_max: int = 100000
     ):
         self.model_file_path = model_file_path
-        self.file_in_bytes = self.load_file_or_text(
-            data = self.model_file_path,
-            from_file=True, 
-            decode_base64=True
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.onnx_file = onnx_file
+        self.cache_dir = cache_dir
+        self.contract_cache = contract_cache
+
+        # Umbrales del nivel léxico de la cascada de similitud (None = sin ese corte)
+        self.cascade_accept = cascade_accept
+        self.cascade_reject = cascade_reject
+        self.cascade_method = cascade_method
+        self.cascade_sample_size = cascade_sample_size
+
+        # Extracción de texto: cantidad de procesos (0 = en el mismo proceso) y límites.
+        # Con límites, el texto (y su embedding) se guarda en caché bajo una variante propia
+        self.pdf_workers = pdf_workers
+        self.pdf_max_pages = pdf_max_pages
+        self.pdf_max_chars = pdf_max_chars
+        self.text_variant = ""
+        if pdf_max_pages is not None or pdf_max_chars is not None:
+            self.text_variant = f"_p{pdf_max_pages or ''}_c{pdf_max_chars or ''}"
+        self._pdf_executor: Optional[ProcessPoolExecutor] = None
+        self._pdf_executor_lock = threading.Lock()
+
+        # Comparación por secciones (activa si hay umbral de aceptación): el documento se
+        # codifica de a section_batch secciones de section_chars caracteres, y se deja de
+        # leer y codificar apenas el resultado queda decidido respecto de section_accept
+        self.section_accept = section_accept
+        self.section_chars = section_chars
+        self.section_min = section_min
+        self.section_batch = section_batch
+        self._reference_sections: Optional[List[np.ndarray]] = None
+
+        # Índice de documentos casi idénticos (activo si hay umbral): un documento cuyo
+        # texto es casi igual al de uno ya evaluado reutiliza su resultado, sin embedding
+        self.near_duplicates: Optional[NearDuplicateIndex] = None
+        if near_duplicate_threshold is not None:
+            self.near_duplicates = NearDuplicateIndex(
+                threshold=near_duplicate_threshold,
+                bands=near_duplicate_bands,
+                rows=near_duplicate_rows,
+                shingle_size=near_duplicate_shingle,
+                max_clusters=near_duplicate_max
+            )
+
+        # Plantillas de contrato contra las que se compara: el ejemplo (si se entregó) más
+        # las de template_paths, cada una con su nombre (el del archivo, sin extensión).
+        # La primera sigue siendo "el ejemplo" para los métodos que comparan contra uno solo
+        paths = [model_file_path] if model_file_path else []
+        for path in template_paths or []:
+            if os.path.realpath(path) not in [os.path.realpath(known) for known in paths]:
+                paths.append(path)
+        if not paths:
+            raise ValueError("No hay contrato de ejemplo: definir EXAMPLE_FILE o TEMPLATES_DIR")
+        self.templates: List[Tuple[str, bytes]] = [
+            (
+                os.path.splitext(os.path.basename(path))[0],
+                self.load_file_or_text(data=path, from_file=True, decode_base64=True)
             )
+            for path in paths
+        ]
+        self.file_in_bytes = self.templates[0][1]
         if use_embeddings:
-            self.model = SentenceTransformer(model_name)
+            self.model = load_embedding_model(model_name, embedding_backend, embedding_threads, onnx_file)
         else:
             self.model = None
 
+        # Textos y embeddings de las plantillas (los embeddings apilados en una matriz, una
+        # fila por plantilla). Se calculan una sola vez (en el primer uso) y se mantienen
+        # en memoria para todas las comparaciones
+        self._reference_texts: Optional[List[str]] = None
+        self._reference_embeddings: Optional[np.ndarray] = None
+        self._reference_lock = threading.RLock()
+
 
     def load_file_or_text(self, data, from_file=True, decode_base64=False):
         """
@@ -52,13 +250,72 @@ class FileCompare():
     def pdf_to_text(self, file_bytes):
         ''' 
         Convertir un archivo PDF (en stream de bytes) a una representación de texto.
-        Recibe file_bytes y devuelve text.
+        Recibe file_bytes y devuelve text. Si hay procesos configurados, la extracción
+        corre en el pool de procesos (fuera del GIL del proceso principal).
         '''
-        reader = PdfReader(BytesIO(file_bytes))
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
+        return self.pdf_to_texts([file_bytes], raise_errors=True)[0]
+
+    def pdf_to_texts(self, files, raise_errors=False):
+        '''
+        Convertir varios archivos PDF a texto, en paralelo si hay procesos configurados.
+        Retorna una lista con un texto por archivo (None si no se pudo leer el archivo,
+        salvo que raise_errors=True, en cuyo caso se propaga la excepción).
+        '''
+        with get_metrics().stage("pdf_to_text"):
+            return self._pdf_to_texts(files, raise_errors)
+
+    def _pdf_to_texts(self, files, raise_errors):
+        executor = self._get_pdf_executor()
+        if executor is not None:
+            # Un archivo mapeado en memoria no se puede enviar a otro proceso: se envían sus bytes
+            futures = [
+                executor.submit(
+                    extract_pdf_text,
+                    file_bytes[:] if isinstance(file_bytes, mmap.mmap) else file_bytes,
+                    self.pdf_max_pages,
+                    self.pdf_max_chars
+                )
+                for file_bytes in files
+            ]
+
+        texts = []
+        for position, file_bytes in enumerate(files):
+            try:
+                if executor is not None:
+                    texts.append(futures[position].result())
+                else:
+                    texts.append(extract_pdf_text(file_bytes, self.pdf_max_pages, self.pdf_max_chars))
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"Error procesando el archivo: {e}")
+                texts.append(None)
+        return texts
+
+    def _get_pdf_executor(self) -> Optional[ProcessPoolExecutor]:
+        '''
+        Pool de procesos para la extracción de texto, creado en el primer uso.
+        Se usa "spawn" para no copiar con fork un proceso que ya tiene hilos corriendo.
+        '''
+        if self.pdf_workers <= 0:
+            return None
+        if self._pdf_executor is None:
+            with self._pdf_executor_lock:
+                if self._pdf_executor is None:
+                    self._pdf_executor = ProcessPoolExecutor(
+                        max_workers=self.pdf_workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._pdf_executor
+
+    def close(self):
+        '''
+        Libera los recursos del comparador (pool de procesos de extracción de texto).
+        '''
+        with self._pdf_executor_lock:
+            if self._pdf_executor is not None:
+                self._pdf_executor.shutdown()
+                self._pdf_executor = None
     
 
     def similarity_text(self, a_bytes, b_bytes):
@@ -76,6 +333,118 @@ class FileCompare():
         return self.embedding_similarity(text_a, text_b)
     
 
+    @property
+    def template_names(self) -> List[str]:
+        return [name for name, _ in self.templates]
+
+    @property
+    def reference_texts(self) -> List[str]:
+        '''
+        Texto extraído de cada plantilla. Se calcula en el primer uso y,
+        si hay un directorio de caché configurado, se guarda en disco.
+        '''
+        if self._reference_texts is None:
+            with self._reference_lock:
+                if self._reference_texts is None:
+                    self._reference_texts = [
+                        self._load_reference_text(file_bytes) for _, file_bytes in self.templates
+                    ]
+        return self._reference_texts
+
+    @property
+    def reference_embeddings(self) -> np.ndarray:
+        '''
+        Embeddings (normalizados) de las plantillas, apilados en una matriz de una fila por
+        plantilla. Se calculan en el primer uso y, si hay un directorio de caché configurado,
+        se guardan en disco asociados al hash de cada archivo y al nombre del modelo.
+        '''
+        if self._reference_embeddings is None:
+            with self._reference_lock:
+                if self._reference_embeddings is None:
+                    self._reference_embeddings = self._load_reference_embeddings()
+        return self._reference_embeddings
+
+    @property
+    def reference_sections(self) -> List[np.ndarray]:
+        '''
+        Embeddings (normalizados) de las secciones de cada plantilla: una matriz de una fila
+        por sección para cada plantilla. Se calculan en el primer uso y, si hay un directorio
+        de caché configurado, se guardan en disco como los del documento completo.
+        '''
+        if self._reference_sections is None:
+            with self._reference_lock:
+                if self._reference_sections is None:
+                    self._reference_sections = self._load_reference_sections()
+        return self._reference_sections
+
+    def load_references(self):
+        '''
+        Calcula por adelantado los embeddings de las plantillas que usa la comparación
+        configurada (por secciones o del documento completo).
+        '''
+        if self.section_accept is not None:
+            self.reference_sections
+        else:
+            self.reference_embeddings
+
+    def _reference_cache_path(self, file_bytes, suffix):
+        '''
+        Ruta del archivo de caché para una plantilla, o None si no hay caché.
+        La llave es el hash SHA-256 del archivo de la plantilla (más el modelo, si aplica).
+        '''
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}{suffix}")
+
+    def _load_reference_text(self, file_bytes):
+        path = self._reference_cache_path(file_bytes, f"{self.text_variant}.txt")
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+
+        text = self.pdf_to_text(file_bytes)
+        if path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+    def _load_reference_embeddings(self):
+        paths = [
+            self._reference_cache_path(file_bytes, f"_{self._model_key}{self.text_variant}.npy")
+            for _, file_bytes in self.templates
+        ]
+
+        # Recuperar de la caché los embeddings disponibles y codificar el resto juntos
+        embeddings = [np.load(path) if path and os.path.exists(path) else None for path in paths]
+        missing = [position for position, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            texts = self.reference_texts
+            encoded = self.model.encode([texts[position] for position in missing], normalize_embeddings=True)
+            for position, embedding in zip(missing, encoded):
+                embeddings[position] = embedding
+                if paths[position]:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    np.save(paths[position], embedding)
+
+        return np.stack(embeddings)
+
+    def _load_reference_sections(self):
+        sections = []
+        for (_, file_bytes), text in zip(self.templates, self.reference_texts):
+            path = self._reference_cache_path(file_bytes, f"_{self._model_key}{self.text_variant}_s{self.section_chars}.npy")
+            if path and os.path.exists(path):
+                sections.append(np.load(path))
+                continue
+
+            embeddings = self.model.encode(split_sections(text, self.section_chars) or [""], normalize_embeddings=True)
+            if path:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                np.save(path, embeddings)
+            sections.append(embeddings)
+        return sections
+
     def token_jaccard_similarity(self, text1, text2):
         '''
         Implementa una comparación de los textos a través de similaridad Jaccard,
@@ -87,9 +456,13 @@ class FileCompare():
         '''
         tokens1 = set(text1.split())
         tokens2 = set(text2.split())
-        return len(tokens1 & tokens2) / len(tokens1 | tokens2)
+        union = tokens1 | tokens2
+        if not union:
+            return 0.0
+        return len(tokens1 & tokens2) / len(union)
     
     def embedding_similarity(self, text1, text2):
+        from sentence_transformers import util
         
         embedding1 = self.model.encode(text1, convert_to_tensor=True)
         embedding2 = self.model.encode(text2, convert_to_tensor=True)
@@ -109,28 +482,403 @@ class FileCompare():
 
         return difflib.SequenceMatcher(None, a_text, b_text).ratio()
     
+    def document_text(self, file_bytes, digest=None):
+        '''
+        Texto de un archivo PDF. Si hay caché de contratos, se reutiliza el texto ya
+        extraído para el mismo contenido (mismo hash) y se guarda el nuevo.
+        '''
+        return self.document_texts([file_bytes], [digest], raise_errors=True)[0]
+
+    def document_texts(self, files, digests=None, raise_errors=False):
+        '''
+        Texto de varios archivos PDF. Los que están en la caché de contratos no se vuelven
+        a procesar; el resto se extrae (en paralelo, si hay procesos configurados).
+        Retorna una lista con un texto por archivo (None si no se pudo leer el archivo).
+        '''
+        texts = [None] * len(files)
+        digests = list(digests) if digests is not None else [None] * len(files)
+
+        # Recuperar de la caché los textos disponibles
+        positions = []
+        for position, file_bytes in enumerate(files):
+            if self.contract_cache is not None:
+                digests[position] = digests[position] or self.contract_cache.digest(file_bytes)
+                texts[position] = self.contract_cache.get_text(digests[position], self.text_variant)
+            if texts[position] is None:
+                positions.append(position)
+
+        # Extraer el resto y guardarlo en caché
+        extracted = self.pdf_to_texts([files[position] for position in positions], raise_errors=raise_errors)
+        for position, text in zip(positions, extracted):
+            texts[position] = text
+            if text is not None and self.contract_cache is not None:
+                self.contract_cache.put_text(digests[position], text, self.text_variant)
+
+        return texts
+
+    @property
+    def _model_key(self):
+        # Los embeddings dependen del modelo y, salvo con torch, del backend que los calcula
+        # (con ONNX, también del archivo .onnx elegido, si no es el por defecto)
+        model_key = str(self.model_name).replace("/", "_")
+        if self.embedding_backend != "torch":
+            model_key += f"_{self.embedding_backend}"
+        if self.onnx_file and self.embedding_backend.startswith("onnx"):
+            model_key += "_" + os.path.splitext(self.onnx_file)[0].replace("/", "_").replace("\\", "_")
+        return model_key
+
+    @property
+    def _embedding_key(self):
+        # Los embeddings dependen del modelo (y backend) y de los límites de extracción del texto
+        return f"{self._model_key}{self.text_variant}"
+
+    def text_embeddings(self, texts, digests=None, batch_size=32):
+        '''
+        Embeddings (normalizados) de varios textos. Si hay caché de contratos y se entregan
+        los hashes de los archivos de origen, los embeddings ya calculados no se vuelven a
+        calcular; el resto se codifica en lotes de batch_size.
+        '''
+        embeddings = [None] * len(texts)
+        digests = digests or [None] * len(texts)
+
+        # Recuperar de la caché los embeddings disponibles
+        positions = []
+        for position, digest in enumerate(digests):
+            if self.contract_cache is not None and digest is not None:
+                embeddings[position] = self.contract_cache.get_embedding(digest, self._embedding_key)
+            if embeddings[position] is None:
+                positions.append(position)
+
+        if not positions:
+            return embeddings
+
+        # Codificar en lotes los textos pendientes
+        with get_metrics().stage("embedding"):
+            encoded = self.model.encode(
+                [texts[position] for position in positions],
+                batch_size=batch_size,
+                normalize_embeddings=True
+            )
+        for position, embedding in zip(positions, encoded):
+            embeddings[position] = embedding
+            if self.contract_cache is not None and digests[position] is not None:
+                self.contract_cache.put_embedding(digests[position], self._embedding_key, embedding)
+
+        return embeddings
+
+    def lexical_similarity(self, text) -> Optional[Similarity]:
+        '''
+        Primer nivel de la cascada de similitud: una comparación léxica barata contra el
+        texto de cada plantilla (Jaccard de tokens, o difflib sobre una muestra del texto),
+        quedándose con la más parecida.
+        Retorna el resultado solo si el documento queda claramente aceptado o rechazado
+        según los umbrales configurados; si queda en la zona intermedia retorna None.
+        '''
+        if self.cascade_accept is None and self.cascade_reject is None:
+            return None
+
+        if self.cascade_method == "difflib":
+            scores = [
+                difflib.SequenceMatcher(
+                    None,
+                    text[:self.cascade_sample_size],
+                    reference_text[:self.cascade_sample_size]
+                ).ratio()
+                for reference_text in self.reference_texts
+            ]
+        else:
+            scores = [
+                self.token_jaccard_similarity(text, reference_text)
+                for reference_text in self.reference_texts
+            ]
+        best = int(np.argmax(scores))
+        score = scores[best]
+
+        if self.cascade_accept is not None and score >= self.cascade_accept:
+            return Similarity(score, "lexico", self.template_names[best])
+        if self.cascade_reject is not None and score <= self.cascade_reject:
+            return Similarity(score, "lexico", self.template_names[best])
+        return None
+
+    def section_similarity(self, file_bytes, digest=None) -> Similarity:
+        '''
+        Comparación por secciones contra las plantillas, con salida temprana.
+
+        Cada sección del documento se compara con la sección en la misma posición de cada
+        plantilla (o una vecina, para tolerar desfases) y el coeficiente es el promedio de
+        esas similitudes sobre las secciones de la plantilla (las que falten cuentan 0).
+        Se deja de leer el archivo y de codificar secciones apenas el promedio parcial
+        (después de section_min secciones) supera section_accept, o cuando ninguna
+        plantilla puede llegar a ese umbral aunque las secciones restantes fueran idénticas.
+        En esos casos el coeficiente es el promedio de las secciones comparadas.
+        '''
+        references = self.reference_sections
+        lengths = np.array([len(reference) for reference in references])
+
+        # Si el texto ya está en la caché de contratos no hace falta leer el archivo
+        text = None
+        if self.contract_cache is not None:
+            digest = digest or self.contract_cache.digest(file_bytes)
+            text = self.contract_cache.get_text(digest, self.text_variant)
+        if text is not None:
+            sections = iter(split_sections(text, self.section_chars))
+        else:
+            sections = iter_pdf_sections(file_bytes, self.section_chars, self.pdf_max_pages, self.pdf_max_chars)
+
+        totals = np.zeros(len(references))
+        compared = 0
+        with get_metrics().stage("section_embedding"):
+            while compared < lengths.max():
+                # Solo interesan tantas secciones como tenga la plantilla más larga
+                group = list(islice(sections, min(self.section_batch, int(lengths.max()) - compared)))
+                if not group:
+                    break
+
+                for embedding in self.model.encode(group, normalize_embeddings=True):
+                    for template, reference in enumerate(references):
+                        if compared < len(reference):
+                            neighbours = reference[max(0, compared - 1):compared + 2]
+                            totals[template] += float((neighbours @ embedding).max())
+                    compared += 1
+
+                # Promedio parcial y máximo alcanzable de cada plantilla
+                seen = np.maximum(np.minimum(compared, lengths), 1)
+                running = totals / seen
+                reachable = (totals + (lengths - seen)) / lengths
+                best = int(running.argmax())
+                if compared >= self.section_min and running[best] >= self.section_accept:
+                    return Similarity(float(running[best]), "secciones", self.template_names[best])
+                if reachable.max() < self.section_accept:
+                    return Similarity(float(running[best]), "secciones", self.template_names[best])
+
+        final = totals / lengths
+        best = int(final.argmax())
+        return Similarity(float(final[best]), "secciones", self.template_names[best])
+
+    def _evaluate_sections(self, files, raise_errors):
+        similarities = []
+        for file_bytes in files:
+            try:
+                similarities.append(self.section_similarity(file_bytes))
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"Error procesando el archivo: {e}")
+                similarities.append(None)
+        return similarities
+
+    def evaluate_batch_to_example(self, files, batch_size=32, raise_errors=False):
+        '''
+        Evaluar varios archivos PDF (streams de bytes) contra las plantillas de contrato.
+        Cada archivo pasa primero por el nivel léxico de la cascada; los que no quedan
+        decididos ahí se codifican en lotes de batch_size y se comparan con los embeddings
+        de todas las plantillas en una sola multiplicación de matrices, quedándose con la
+        plantilla de mayor coeficiente.
+        Retorna una lista de Similarity (score, nivel que lo decidió y plantilla), con None
+        para los archivos que no se pudieron leer (o propaga la excepción si raise_errors=True).
+        '''
+        # Con la comparación por secciones cada archivo se lee solo hasta quedar decidido,
+        # así que no se extrae el texto completo por adelantado (ni se usa el nivel léxico)
+        if self.section_accept is not None:
+            similarities = self._evaluate_sections(files, raise_errors)
+            for similarity in similarities:
+                if similarity is not None:
+                    show(f"Similarity ratio: {similarity.score} ({similarity.tier}, plantilla {similarity.template})")
+            return similarities
+
+        similarities = [None] * len(files)
+        digests = [None] * len(files)
+
+        # Convertir a texto (en paralelo, si hay procesos configurados)
+        if self.contract_cache is not None:
+            digests = [self.contract_cache.digest(file_bytes) for file_bytes in files]
+        texts = self.document_texts(files, digests, raise_errors=raise_errors)
+
+        # Documentos casi idénticos a uno ya evaluado: reutilizar su resultado. Del resto,
+        # solo el primero de cada grupo nuevo (representante) sigue a la cascada
+        clusters, followers = self._match_near_duplicates(texts, similarities)
+
+        pending = []
+        for position in range(len(files)):
+            # Descartar los archivos que no se pudieron leer, y los ya resueltos
+            if texts[position] is None or similarities[position] is not None or position in followers:
+                continue
+
+            # Nivel léxico: si decide, no hace falta calcular el embedding
+            similarities[position] = self.lexical_similarity(texts[position])
+            if similarities[position] is None:
+                pending.append(position)
+
+        # Nivel de embeddings para los casos ambiguos (todos, si la cascada está desactivada)
+        if pending:
+            embeddings = self.text_embeddings(
+                [texts[position] for position in pending],
+                [digests[position] for position in pending],
+                batch_size=batch_size
+            )
+            # Matriz documentos x plantillas; la mejor plantilla de cada documento por fila
+            scores = np.stack(embeddings) @ self.reference_embeddings.T
+            best = scores.argmax(axis=1)
+            for position, row, template in zip(pending, scores, best):
+                similarities[position] = Similarity(float(row[template]), "embedding", self.template_names[template])
+
+        # Guardar el resultado de cada representante en su grupo y copiarlo a los demás
+        # documentos del grupo que venían en este mismo lote
+        for position, cluster in clusters.items():
+            self.near_duplicates.set_value(cluster, similarities[position])
+        for position, representative in followers.items():
+            similarity = similarities[representative]
+            similarities[position] = Similarity(similarity.score, "duplicado", similarity.template)
+
+        for similarity in similarities:
+            if similarity is not None:
+                show(f"Similarity ratio: {similarity.score} ({similarity.tier}, plantilla {similarity.template})")
+
+        return similarities
+
+    def _match_near_duplicates(self, texts, similarities):
+        '''
+        Busca cada texto en el índice de documentos casi idénticos. Los que coinciden con
+        un grupo ya evaluado reciben su resultado (nivel "duplicado") en similarities.
+        Retorna los grupos nuevos creados en este lote ({posición del representante:
+        grupo}) y los documentos que esperan el resultado de un representante del lote
+        ({posición: posición del representante}).
+        '''
+        clusters, followers = {}, {}
+        if self.near_duplicates is None:
+            return clusters, followers
+
+        representatives = {}
+        with get_metrics().stage("near_duplicate"):
+            for position, text in enumerate(texts):
+                if text is None:
+                    continue
+                signature = self.near_duplicates.signature(text)
+                if signature is None:
+                    continue
+
+                cluster = self.near_duplicates.find(signature)
+                if cluster is None:
+                    cluster = self.near_duplicates.add(signature)
+                    if cluster is not None:
+                        clusters[position] = cluster
+                        representatives[cluster] = position
+                elif cluster in representatives:
+                    followers[position] = representatives[cluster]
+                else:
+                    # Un grupo que otro hilo todavía está evaluando se trata como nuevo
+                    similarity = self.near_duplicates.value(cluster)
+                    if similarity is not None:
+                        similarities[position] = Similarity(similarity.score, "duplicado", similarity.template)
+
+        return clusters, followers
+
+    def evaluate_to_example(self, bytes) -> Similarity:
+        '''
+        Evaluar un archivo PDF contra las plantillas. Retorna el score, el nivel que lo
+        decidió y la plantilla más parecida.
+        '''
+        return self.evaluate_batch_to_example([bytes], batch_size=1, raise_errors=True)[0]
+
     def compare_to_example(self, bytes, sample_size=5000):
 
-        # Calcular el coeficioente de similutd
-        ratio = self.similarity_text(self.file_in_bytes, bytes)
-        print(f"Similarity ratio: {ratio}")
+        # Calcular el coeficioente de similutd contra el ejemplo precalculado
+        ratio = self.evaluate_to_example(bytes).score
         
         # Retonar coeficiente
         return ratio
+
+    def compare_batch_to_example(self, files, batch_size=32):
+        '''
+        Calcular la similitud de varios archivos PDF (streams de bytes) contra el ejemplo.
+        Retorna una lista con un coeficiente por archivo (None si no se pudo leer el archivo).
+        '''
+        similarities = self.evaluate_batch_to_example(files, batch_size=batch_size)
+        return [similarity.score if similarity is not None else None for similarity in similarities]
     
 
 _compare_instance: Optional[FileCompare] = None
+_instance_lock = threading.Lock()
 
 def get_instance() -> FileCompare:
+    '''
+    Retorna el comparador compartido. Se crea (cargando el modelo) en la primera
+    llamada; si hay una precarga en curso (warm_up), espera a que termine.
+    '''
 
     global _compare_instance
 
-    if _compare_instance is None:
+    if _compare_instance is not None:
+        return _compare_instance
+
+    with _instance_lock:
+        if _compare_instance is not None:
+            return _compare_instance
         
         load_dotenv()
         file = os.getenv("EXAMPLE_FILE")
+        templates_dir = os.getenv("TEMPLATES_DIR")
         model_name = os.getenv("MODEL_NAME")
+        cache_dir = os.getenv("REFERENCE_CACHE_DIR")
+        cascade_accept = os.getenv("CASCADE_ACCEPT")
+        cascade_reject = os.getenv("CASCADE_REJECT")
+        pdf_max_pages = os.getenv("PDF_MAX_PAGES")
+        pdf_max_chars = os.getenv("PDF_MAX_CHARS")
+        section_accept = os.getenv("SECTION_ACCEPT")
+        embedding_threads = os.getenv("EMBEDDING_THREADS")
+        near_duplicate_threshold = os.getenv("NEAR_DUPLICATE_THRESHOLD")
         
-        _compare_instance = FileCompare(file, use_embeddings=True, model_name=model_name)
+        _compare_instance = FileCompare(
+            file,
+            use_embeddings=True,
+            model_name=model_name,
+            cache_dir=cache_dir,
+            contract_cache=get_contract_cache(),
+            cascade_accept=float(cascade_accept) if cascade_accept else None,
+            cascade_reject=float(cascade_reject) if cascade_reject else None,
+            cascade_method=os.getenv("CASCADE_METHOD", "jaccard"),
+            cascade_sample_size=int(os.getenv("CASCADE_SAMPLE_SIZE", "5000")),
+            pdf_workers=int(os.getenv("PDF_WORKERS", "0")),
+            pdf_max_pages=int(pdf_max_pages) if pdf_max_pages else None,
+            pdf_max_chars=int(pdf_max_chars) if pdf_max_chars else None,
+            template_paths=template_files(templates_dir) if templates_dir else None,
+            section_accept=float(section_accept) if section_accept else None,
+            section_chars=int(os.getenv("SECTION_CHARS", "1000")),
+            section_min=int(os.getenv("SECTION_MIN", "2")),
+            section_batch=int(os.getenv("SECTION_BATCH", "2")),
+            embedding_backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+            embedding_threads=int(embedding_threads) if embedding_threads else None,
+            onnx_file=os.getenv("EMBEDDING_ONNX_FILE"),
+            near_duplicate_threshold=float(near_duplicate_threshold) if near_duplicate_threshold else None,
+            near_duplicate_bands=int(os.getenv("NEAR_DUPLICATE_BANDS", "32")),
+            near_duplicate_rows=int(os.getenv("NEAR_DUPLICATE_ROWS", "4")),
+            near_duplicate_shingle=int(os.getenv("NEAR_DUPLICATE_SHINGLE", "5")),
+            near_duplicate_max=int(os.getenv("NEAR_DUPLICATE_MAX", "100000"))
+        )
+
+    return _compare_instance
+
+
+def warm_up() -> threading.Thread:
+    '''
+    Inicia en segundo plano la carga del comparador (modelo y embedding del ejemplo),
+    para que esté listo cuando llegue la primera comparación.
+    '''
+    def load():
+        try:
+            get_instance().load_references()
+        except Exception as e:
+            # Si falla, el error se repetirá (y se informará) en el primer uso real
+            print(f"No fue posible precargar el modelo: {e}")
+
+    thread = threading.Thread(target=load, name="compare-warm-up", daemon=True)
+    thread.start()
+    return thread
+
 
-    return _compare_instance
\ No newline at end of file
+def shutdown():
+    '''
+    Libera los recursos del comparador compartido, si se llegó a crear.
+    '''
+    if _compare_instance is not None:
+        _compare_instance.close()
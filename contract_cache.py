@@ -0,0 +1,217 @@
+import hashlib
+import os
+import shutil
+import threading
+from io import BytesIO
+from typing import Optional
+import numpy as np
+from dotenv import load_dotenv
+
+# Al superar el límite, se eliminan entradas hasta quedar en esta fracción del límite,
+# para no recorrer el directorio en cada escritura una vez que la caché está llena
+EVICT_TO = 0.9
+
+
+class ContractCache():
+    '''
+    Caché local de contratos descargados, direccionada por contenido.
+
+    Cada archivo se guarda bajo el hash SHA-256 de sus bytes, junto a su texto extraído
+    y a sus embeddings (uno por modelo). Un índice aparte asocia el "nombreArchivo" del
+    servicio con ese hash, de modo que un acierto permite omitir la descarga.
+    El tamaño total se limita a max_bytes, eliminando las entradas usadas menos
+    recientemente (LRU, según la fecha de último acceso de cada entrada).
+
+    El directorio se puede compartir entre procesos (shards, workers). Cada proceso
+    cuenta lo que escribe él; cuando su cuenta supera el límite, vuelve a calcular el
+    tamaño desde el disco (incluyendo lo escrito por los demás) antes de eliminar.
+    Entre esos recálculos el total en disco puede superar el límite en lo que escriban
+    los otros procesos. Las entradas que otro proceso elimina mientras se recorren se
+    omiten, y una escritura cuya entrada se elimina a medio camino se descarta.
+    '''
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._names_dir = os.path.join(directory, "names")
+        self._objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self._names_dir, exist_ok=True)
+        os.makedirs(self._objects_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._size = sum(size for _, _, size in self._scan())
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _name_path(self, nombre_archivo):
+        key = hashlib.sha1(nombre_archivo.encode("utf-8")).hexdigest()
+        return os.path.join(self._names_dir, key)
+
+    def _entry_path(self, digest, file_name=None):
+        path = os.path.join(self._objects_dir, digest)
+        return os.path.join(path, file_name) if file_name else path
+
+    def _entry_size(self, digest):
+        path = self._entry_path(digest)
+        size = 0
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _scan(self):
+        '''
+        Recorre las entradas en disco y retorna (último uso, hash, tamaño) de cada una.
+        '''
+        entries = []
+        for digest in os.listdir(self._objects_dir):
+            try:
+                used = os.path.getmtime(self._entry_path(digest))
+            except FileNotFoundError:
+                continue
+            entries.append((used, digest, self._entry_size(digest)))
+        return entries
+
+    @staticmethod
+    def _embedding_file(model_name):
+        return f"embedding_{str(model_name).replace('/', '_')}.npy"
+
+    def _read(self, digest, file_name):
+        '''
+        Lee un archivo de una entrada y la marca como usada recientemente.
+        Retorna None si la entrada (o el archivo) no existe.
+        '''
+        path = self._entry_path(digest, file_name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(self._entry_path(digest))
+            return data
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write_atomic(path, data):
+        temp_path = f"{path}.tmp{threading.get_ident()}"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _write(self, digest, file_name, data):
+        '''
+        Escribe un archivo dentro de una entrada (de forma atómica) y aplica el límite de tamaño.
+        '''
+        path = self._entry_path(digest, file_name)
+        with self._lock:
+            try:
+                os.makedirs(self._entry_path(digest), exist_ok=True)
+                previous = os.path.getsize(path) if os.path.exists(path) else 0
+                self._write_atomic(path, data)
+            except FileNotFoundError:
+                # Otro proceso eliminó la entrada mientras se escribía
+                return
+            self._size += len(data) - previous
+            self._evict(keep=digest)
+
+    def _evict(self, keep):
+        '''
+        Si se superó el límite, recalcula el tamaño desde el disco y elimina las entradas
+        usadas menos recientemente hasta quedar en EVICT_TO del límite.
+        '''
+        if self._size <= self.max_bytes:
+            return
+
+        entries = sorted(self._scan())
+        self._size = sum(size for _, _, size in entries)
+        target = self.max_bytes * EVICT_TO
+        for _, digest, size in entries:
+            if self._size <= target:
+                break
+            if digest == keep:
+                continue
+            shutil.rmtree(self._entry_path(digest), ignore_errors=True)
+            self._size -= size
+
+    def lookup(self, nombre_archivo: str) -> Optional[str]:
+        '''
+        Retorna el hash del contenido asociado a un nombre de archivo, si está en caché.
+        '''
+        try:
+            with open(self._name_path(nombre_archivo), "r") as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return digest if os.path.isdir(self._entry_path(digest)) else None
+
+    def get_file(self, digest: str) -> Optional[bytes]:
+        return self._read(digest, "file.pdf")
+
+    def put_file(self, nombre_archivo: Optional[str], data: bytes) -> str:
+        '''
+        Guarda los bytes de un archivo y, si se entrega, su nombre. Retorna el hash.
+        '''
+        digest = self.digest(data)
+        if not os.path.exists(self._entry_path(digest, "file.pdf")):
+            self._write(digest, "file.pdf", data)
+
+        if nombre_archivo:
+            self._write_atomic(self._name_path(nombre_archivo), digest.encode("utf-8"))
+        return digest
+
+    def get_text(self, digest: str, variant: str = "") -> Optional[str]:
+        '''
+        Texto extraído de un archivo. variant distingue textos extraídos con distintos límites.
+        '''
+        data = self._read(digest, f"text{variant}.txt")
+        return data.decode("utf-8") if data is not None else None
+
+    def put_text(self, digest: str, text: str, variant: str = ""):
+        self._write(digest, f"text{variant}.txt", text.encode("utf-8"))
+
+    def get_embedding(self, digest: str, model_name: str) -> Optional[np.ndarray]:
+        '''
+        Embedding de un archivo para un modelo (model_name puede incluir la variante del texto).
+        '''
+        data = self._read(digest, self._embedding_file(model_name))
+        if data is None:
+            return None
+        try:
+            return np.load(BytesIO(data))
+        except ValueError:
+            return None
+
+    def put_embedding(self, digest: str, model_name: str, embedding: np.ndarray):
+        buffer = BytesIO()
+        np.save(buffer, embedding)
+        self._write(digest, self._embedding_file(model_name), buffer.getvalue())
+
+
+_cache_instance: Optional[ContractCache] = None
+_cache_lock = threading.Lock()
+
+def get_contract_cache() -> Optional[ContractCache]:
+    '''
+    Retorna la caché de contratos compartida, o None si CONTRACT_CACHE_DIR no está definido.
+    El tamaño máximo se toma de CONTRACT_CACHE_MAX_MB (por defecto 1024 MB).
+    '''
+    global _cache_instance
+
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                load_dotenv()
+                directory = os.getenv("CONTRACT_CACHE_DIR")
+                if not directory:
+                    return None
+                max_mb = float(os.getenv("CONTRACT_CACHE_MAX_MB", "1024"))
+                _cache_instance = ContractCache(directory, int(max_mb * 1024 * 1024))
+
+    return _cache_instance
@@ -1,4 +1,4 @@
-import pandas as pd
+import argparse
 import requests
 import os
 import datetime
@@ -6,139 +6,236 @@ import sys
 import select
 from dotenv import load_dotenv
 import json
-from compare import get_instance
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Optional
+from compare import NO_SIMILARITY, get_instance, shutdown, warm_up
+from contract_cache import get_contract_cache
+from http_client import ResponseTooLarge, close_sessions, concurrency_summary, download_limits, get_session, read_limited, spool_content
+from input_files import OutputWriter, iter_with_last, read_input
+from journal import Journal
+from metrics import get_metrics, show
+from run_config import RunConfig
+from verified_index import get_verified_index, verified_date
+
+# Resultado de consultar la lista de documentos de un comercio (ENDPOINT_1).
+# Se evalúa como verdadero si la lista incluye un documento "CONTRATOS", para que
+# se pueda usar directamente como resultado del chequeo, y se puede reutilizar en la
+# validación del archivo sin volver a llamar al servicio
+@dataclass
+class DocumentListing:
+    comercio_id: str
+    ok: bool = False
+    documents: list = field(default_factory=list)
+
+    @property
+    def contract(self) -> Optional[dict]:
+        """Returns the "CONTRATOS" document entry, if any."""
+        for doc in self.documents:
+            if doc.get("nombreDocumento") == "CONTRATOS":
+                return doc
+        return None
 
-compare_instance = get_instance()
+    @property
+    def has_contract(self) -> bool:
+        return self.contract is not None
 
-# Método para validar si existe el contrato de un comercio particular.
-# En este caso el "endpoint" corresponde al de creación de contrato T2P.
-# Lo podemos cambiar al de POS pasando datos diferentes al método
-def check_contract(comercio_id, endpoint, headers):
-    """Checks if a contract exists using Endpoint 1."""
-    print(f"Analizando comercio {comercio_id}...", end=" ")
-    response = requests.get(f"{endpoint}/{comercio_id}", headers=headers)
+    def __bool__(self):
+        return self.has_contract
+
+
+# Método para obtener la lista de documentos registrados de un comercio
+def fetch_documents(comercio_id, endpoint, headers):
+    """Fetches the document listing of a merchant using Endpoint 1."""
+    # Si el servicio no responde (agotados los reintentos), la lista queda sin consultar
+    try:
+        with get_metrics().stage("document_listing"):
+            response = get_session(endpoint).get(f"{endpoint}/{comercio_id}", headers=headers)
+    except requests.exceptions.RequestException as e:
+        print(f"Error en la solicitud HTTP: {e}")
+        return DocumentListing(comercio_id)
     
-    # Si el servicio retorna una respuesta de éxito
+    # Si el servicio no retorna una respuesta de éxito, la lista queda vacía
     if response.status_code != 200:
-        return False
+        return DocumentListing(comercio_id)
     
     try:
         # Recuperar los datos de la llamada
         data = response.json()
-        
-        # Si en la lista de documentos existente hay alguno que se identifique como
-        # "CONTRATOS" quiere decir que ya hay un contrato registrado. El método
-        # retorna True. De lo contrario el False
-        # return any(doc.get("nombreDocumento") == "CONTRATOS" for doc in data)
-        for doc in data:
-            if doc.get("nombreDocumento") == "CONTRATOS":
-                return True
-        return False
-        
-        
-        # for doc in data:
-        #     if doc.get("nombreDocumento") == "CONTRATOS":
-        #         json_payload = json.dumps(doc)
-        #         return validate_contract_file(comercio_id, endpoint, headers, json_payload)
-        # return False
+        documents = [doc for doc in data if isinstance(doc, dict)]
+        return DocumentListing(comercio_id, ok=True, documents=documents)
     
-    # Si hay una excepción, retorna False
+    # Si hay una excepción, la lista queda vacía
     except (ValueError, TypeError):
-        return False
+        return DocumentListing(comercio_id)
+
+
+# Método para validar si existe el contrato de un comercio particular.
+# En este caso el "endpoint" corresponde al de creación de contrato T2P.
+# Lo podemos cambiar al de POS pasando datos diferentes al método
+def check_contract(comercio_id, endpoint, headers):
+    """Checks if a contract exists using Endpoint 1.
+
+    Returns the DocumentListing, which is truthy when a "CONTRATOS" document exists.
+    """
+    show(f"Analizando comercio {comercio_id}...", end=" ")
+
+    # Si en la lista de documentos existente hay alguno que se identifique como
+    # "CONTRATOS" quiere decir que ya hay un contrato registrado
+    return fetch_documents(comercio_id, endpoint, headers)
 
 # Método para crear un contrato para un comercio
 # Nuevamente está operando con le endpoint de T2P, pero se puede cambiar
 # # pasando los argumentos correctos al método
 def create_contract(comercio_id, endpoint, headers):
     """Attempts to create a contract using Endpoint 2."""
-    response = requests.post(endpoint, json={"commerceRut": comercio_id}, headers=headers)
+    # La creación no es idempotente: solo se reintenta ante errores de conexión
+    try:
+        with get_metrics().stage("create_contract"):
+            response = get_session(endpoint, retry_post=False).post(endpoint, json={"commerceRut": comercio_id}, headers=headers)
+    except requests.exceptions.RequestException as e:
+        print(f"Error en la solicitud HTTP: {e}")
+        return False
     return response.status_code == 200  # 201 means contract creation was successful
 
 
 # Método para "doble chequear el contrato" (posterior a la regularización).
-# Redirige al método tradicional de chequeo
+# Redirige al método tradicional de chequeo, que vuelve a consultar el servicio
 def double_check_contract(comercio_id, endpoint, headers):
     """Double-checks if the contract was successfully created."""
     return check_contract(comercio_id, endpoint, headers)
 
 
-def validate_contract_file(comercio_id, endpoint, headers, payload):
+def download_contract_file(comercio_id, endpoint, headers, payload):
     '''
-    Validate if contract exists (as file) and if it has a high similarity with
-    a model contract (which implies it is, in fact, a contract)
+    Download the contract file described by payload. Returns the file contents (bytes,
+    or a read-only memory map for large files), or None if the service failed, answered
+    with an error instead of the file, or the file exceeds the maximum download size.
     '''
-    print(f"Validando si existe el archivo de contrato para comercio {comercio_id}...")
+    show(f"Validando si existe el archivo de contrato para comercio {comercio_id}...")
 
     try: 
-        # Obtener instancia de comparador
-        # compare_instance = get_instance()
-
         # Definir endpoint para obtener archivo
         endpoint_comercio = endpoint+comercio_id
 
         # Ensure headers include Content-Type
         headers = headers.copy()
         headers["Content-Type"] = "application/json"
-        
-        # Llamar servicio y ver si es exitoso
-        response = requests.post(endpoint_comercio, data=payload, headers=headers)
-        response.raise_for_status()
-        
-        # Si respondió correctamente
-        if response.status_code == 200:
 
-            # Check if this is actually an error message in JSON format
-            content_type = response.headers.get('Content-Type', '').lower()
-            content_start = response.content[:100].decode('utf-8', errors='ignore')
-            
-            # Detect JSON error responses (common patterns)
-            is_json_error = (
-                'application/json' in content_type or
-                content_start.strip().startswith('{') or
-                '"message":' in content_start or
-                '"status_code":' in content_start
-            )
-            
-            if is_json_error:
-                try:
-                    error_data = response.json()
-                    error_message = error_data.get('message', 'Archivo no encontrado')
-                    print(f"El servicio reportó error: {error_message}")
-                    return (0.0, False)
-                except ValueError:
-                    print("El servicio respondió con contenido inesperado (posible error)")
-                    return (0.0, False)
-            
-            # Cargar el archivo para instancia de comparación
-            try:
-                file = compare_instance.load_file_or_text(
-                    response.content,
-                    from_file=False,
-                    decode_base64=False
-                    )
+        limits = download_limits()
+        
+        # Llamar servicio y ver si es exitoso. La respuesta se lee por streaming, para
+        # decidir con el primer trozo si es un error y no tener el archivo completo en memoria
+        with get_metrics().stage("download"):
+            with get_session(endpoint).post(endpoint_comercio, data=payload, headers=headers, stream=True) as response:
+                response.raise_for_status()
                 
-                # Comparar al ejemplo
-                ratio = compare_instance.compare_to_example(file)
+                # Si no respondió correctamente
+                if response.status_code != 200:
+                    return None
+
+                # Si el servicio informa el tamaño y es mayor al máximo, no descargar
+                content_length = response.headers.get('Content-Length')
+                if content_length and content_length.isdigit() and int(content_length) > limits.max_bytes:
+                    print(f"El archivo del comercio {comercio_id} supera el tamaño máximo de descarga ({content_length} bytes)")
+                    return None
+
+                chunks = response.iter_content(chunk_size=limits.chunk_bytes)
+                first_chunk = next(chunks, b"")
+
+                # Check if this is actually an error message in JSON format
+                content_type = response.headers.get('Content-Type', '').lower()
+                content_start = first_chunk[:100].decode('utf-8', errors='ignore')
                 
-                # Retornar el coeficiente y verdadero
-                return (ratio, True)
-            
-            except:
-                print(f"Error procesando el archivo: {e}")
-                return (0.0, False)
-        
-        else:
-            return (0.0, False)
-        
+                # Detect JSON error responses (common patterns)
+                is_json_error = (
+                    'application/json' in content_type or
+                    content_start.strip().startswith('{') or
+                    '"message":' in content_start or
+                    '"status_code":' in content_start
+                )
+                
+                if is_json_error:
+                    try:
+                        # Los errores son pequeños: leer solo hasta un trozo más
+                        error_data = json.loads(read_limited(first_chunk, chunks, 2 * limits.chunk_bytes))
+                        error_message = error_data.get('message', 'Archivo no encontrado')
+                        print(f"El servicio reportó error: {error_message}")
+                    except (ValueError, AttributeError, ResponseTooLarge):
+                        print("El servicio respondió con contenido inesperado (posible error)")
+                    return None
+                
+                # Retornar el archivo (bytes, o mapeado desde un archivo temporal si es grande),
+                # listo para la instancia de comparación
+                return spool_content(first_chunk, chunks, limits)
+
+    except ResponseTooLarge as e:
+        print(f"El archivo del comercio {comercio_id} supera el tamaño máximo de descarga: {e}")
+        return None
     except requests.exceptions.RequestException as e:
         print(f"Error en la solicitud HTTP: {e}")
-        return (0.0, False)
+        return None
     except Exception as e:
         print(f"Error inesperado: {e}")
-        return (0.0, False)
+        return None
+
+
+def validate_contract_file(comercio_id, endpoint, headers, payload):
+    '''
+    Validate if contract exists (as file) and if it has a high similarity with
+    a model contract (which implies it is, in fact, a contract)
+    '''
+    file = download_contract_file(comercio_id, endpoint, headers, payload)
+    if file is None:
+        return (NO_SIMILARITY, False)
+
+    return score_contract_file(file)
+
+
+# Método para comparar un archivo de contrato ya descargado con el ejemplo
+def score_contract_file(file):
+    """Compares a downloaded contract file to the example. Returns (similarity, is_valid)."""
+    try:
+        # Comparar al ejemplo
+        similarity = get_instance().evaluate_to_example(file)
+        
+        # Retornar el coeficiente (con el nivel que lo decidió) y verdadero
+        return (similarity, True)
+    
+    except Exception as e:
+        print(f"Error procesando el archivo: {e}")
+        return (NO_SIMILARITY, False)
+
+
+# Método para descargar el archivo de contrato de un comercio a partir de su lista de
+# documentos, sin compararlo. Retorna None si no hay contrato o no se pudo descargar
+def fetch_contract_file(comercio_id, endpoint, headers, listing=None):
+    """Downloads the "CONTRATOS" file listed for a merchant."""
+    if listing is None:
+        listing = fetch_documents(comercio_id, endpoint, headers)
+
+    contract = listing.contract
+    if contract is None:
+        return None
+
+    # Si el archivo ya está en la caché local de contratos, no volver a descargarlo
+    contract_cache = get_contract_cache()
+    nombre_archivo = contract.get("nombreArchivo")
+    if contract_cache is not None and nombre_archivo:
+        digest = contract_cache.lookup(nombre_archivo)
+        if digest is not None:
+            file = contract_cache.get_file(digest)
+            if file is not None:
+                show(f"Archivo de contrato para comercio {comercio_id} recuperado de la caché")
+                return file
+
+    file = download_contract_file(comercio_id, endpoint, headers, json.dumps(contract))
+    if file is not None and contract_cache is not None:
+        contract_cache.put_file(nombre_archivo, file)
+    return file
 
     
-def compare_contract_file_to_example(comercio_id, endpoint, headers):
+def compare_contract_file_to_example(comercio_id, endpoint, headers, listing=None):
 
     # compare_instance = get_instance()
     
@@ -157,36 +254,232 @@ def compare_contract_file_to_example(comercio_id, endpoint, headers):
     # else:
     #     return 0.0, False
 
-    response = requests.get(f"{endpoint}/{comercio_id}", headers=headers)
-    
-    # Si el servicio retorna una respuesta de éxito
-    if response.status_code != 200:
-        return False
-    
-    try:
-        # Recuperar los datos de la llamada
-        data = response.json()
-        
-        # Si en la lista de documentos existente hay alguno que se identifique como
-        # "CONTRATOS" quiere decir que ya hay un contrato registrado. El método
-        # retorna True. De lo contrario el False
-        # return any(doc.get("nombreDocumento") == "CONTRATOS" for doc in data)
-        for doc in data:
-            if doc.get("nombreDocumento") == "CONTRATOS":
-                json_payload = json.dumps(doc)
-                ratio, is_valid = validate_contract_file(comercio_id, endpoint, headers, json_payload)
-                return (ratio, is_valid)
-        return (0.0, False)
-    
-    # Si hay una excepción, retorna False
-    except (ValueError, TypeError):
-        return False
+    # Obtener el archivo "CONTRATOS" de la lista de documentos (reutilizando la lista
+    # ya obtenida, si se entregó) y compararlo. Si no hay contrato no hay nada que comparar
+    file = fetch_contract_file(comercio_id, endpoint, headers, listing)
+    if file is None:
+        return (NO_SIMILARITY, False)
+
+    return score_contract_file(file)
+
+
+# Resultado del procesamiento de un comercio. Los valores de "contrato" y "similitud"
+# son los que se deben escribir en la fila (None = no modificar la columna), y
+# "outcome" se usa para calcular los contadores del bloque. Si la comparación se
+# difiere, "pending_file" guarda el archivo descargado hasta que se evalúe en lote
+@dataclass
+class MerchantResult:
+    comercio_id: str
+    outcome: str
+    contrato: Optional[str] = None
+    similitud: Optional[float] = None
+    nivel: Optional[str] = None
+    plantilla: Optional[str] = None
+    nombre_archivo: Optional[str] = None
+    log_entries: list = field(default_factory=list)
+    repair: bool = False
+    pending_file: Optional[bytes] = None
+
+
+# Método para registrar en el resultado de un comercio el resultado de la validación
+# de su archivo de contrato, según si se intentó reparar o si ya existía
+def apply_validation(result, similarity, is_valid):
+    """Updates a MerchantResult with the outcome of the contract file validation."""
+    result.similitud = similarity.score
+    result.nivel = similarity.tier
+    result.plantilla = similarity.template
+
+    # Contrato recién creado
+    if result.repair:
+        if is_valid:
+            # Marcar el contrato como existente
+            result.contrato = "Si"
+            result.outcome = "reparado"
+            show("reparado correctamente")
+            result.log_entries[-1] += " reparación exitosa"
+        else:
+            result.contrato = "No"
+            result.outcome = "reparacion_fallida"
+            show("la reparación falló")
+            result.log_entries[-1] += " reparación sin éxito"
+
+    # Si el contrato ya existía, o sea, estaba mal clasificado, informar y actualizar estado en la fila
+    else:
+        if is_valid:
+            result.contrato = "Si"
+            result.outcome = "mal_clasificado"
+            show("contrato ya está registrado en los sistemas")
+            result.log_entries.append(f"El contrato del comercio {result.comercio_id} ya estaba guardado en los sistemas... OK!")
+
+        else:
+            result.contrato = "No"
+            result.outcome = "error_descarga"
+            show(f"Error al descargar archivo para comercio {result.comercio_id}")
+            result.log_entries[-1] += f" Error al descargar archivo para comercio {result.comercio_id}"
+
+
+# Método para procesar un único comercio: chequeo, creación, doble chequeo y validación
+# del archivo. No toca el DataFrame, para que se pueda ejecutar en paralelo.
+# Con defer_scoring=True solo se descarga el archivo, y la comparación con el ejemplo
+# queda pendiente para hacerse en lote (ver score_pending_results)
+def process_merchant(comercio_id, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring=False):
+    """Checks, repairs and validates the contract of a single merchant."""
+    with get_metrics().merchant():
+        return _process_merchant(comercio_id, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring)
+
+
+def _process_merchant(comercio_id, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring):
+    result = classify_merchant(comercio_id, endpoint_1, headers_1, defer_scoring)
+    if result.repair:
+        repair_merchant(result, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring)
+    return result
+
+
+# Resultado inicial de un comercio sin contrato declarado, con su mensaje de reparación
+def new_merchant_result(comercio_id):
+    """Returns an empty MerchantResult for a merchant without a declared contract."""
+    result = MerchantResult(comercio_id, outcome="sin_contrato")
+    result.log_entries.append(f"Comercio {comercio_id} no tiene registro de contrato en sistema... reparando...")
+    return result
+
+
+# Primera parte del proceso de un comercio, solo con llamadas de lectura: chequeo y, si
+# el contrato existe, validación del archivo. Si no existe, el resultado queda marcado
+# para reparar (repair=True, outcome "sin_contrato") sin haber llamado a la creación.
+# Si la consulta de documentos falló, el outcome es "error_consulta" y no se repara
+def classify_merchant(comercio_id, endpoint_1, headers_1, defer_scoring=False):
+    """Checks a merchant's contract and validates its file, without repairing it."""
+    result = new_merchant_result(comercio_id)
+
+    listing = check_contract(comercio_id, endpoint_1, headers_1)
+    if not listing.ok:
+        listing_error(result)
+        return result
+
+    # Si no existe el contrato
+    if not listing:
+        show("contrato no encontrado, buscaremos reparar")
+        result.repair = True
+        return result
+
+    validate_listing(result, endpoint_1, headers_1, listing, defer_scoring)
+    return result
+
+
+# Si la consulta de documentos falló (error del servicio después de los reintentos) no se
+# sabe si el contrato existe: el comercio no se repara, y queda para una próxima revisión
+def listing_error(result):
+    """Marks a MerchantResult whose document listing could not be read."""
+    result.outcome = "error_consulta"
+    show("no fue posible consultar los documentos")
+    result.log_entries[-1] = f"No fue posible consultar los documentos del comercio {result.comercio_id}, queda pendiente"
+
+
+# Segunda parte del proceso, para un comercio clasificado sin contrato: creación del
+# contrato, doble chequeo y validación del archivo creado. Si se entrega un limiter
+# (http_client.RateLimiter), cada creación espera su turno antes de llamar al servicio.
+# Con check_first=True (reintento de una reparación anterior) primero se vuelve a
+# consultar, para no crear de nuevo un contrato que ya se creó
+def repair_merchant(result, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring=False, limiter=None, check_first=False):
+    """Creates the missing contract of a classified merchant and validates it."""
+    comercio_id = result.comercio_id
+    result.outcome = "reparacion_fallida"
+
+    listing = None
+    if check_first:
+        listing = check_contract(comercio_id, endpoint_1, headers_1)
+        if not listing.ok:
+            listing_error(result)
+            return result
+
+    # Crear el contrato (si no existe) y revisar que quedó OK. Informar éxito o fracaso
+    if not listing:
+        listing = None
+        if limiter is not None:
+            limiter.acquire()
+        if create_contract(comercio_id, endpoint_2, headers_2):
+            listing = double_check_contract(comercio_id, endpoint_1, headers_1)
+
+    if not listing:
+        show("la reparación falló")
+        result.log_entries[-1] += " reparación sin éxito"
+        return result
+
+    validate_listing(result, endpoint_1, headers_1, listing, defer_scoring)
+    return result
+
+
+# Validar el archivo, reutilizando la lista de documentos del chequeo (o del doble chequeo)
+def validate_listing(result, endpoint_1, headers_1, listing, defer_scoring):
+    """Validates (or downloads, for deferred scoring) the contract file of a listing."""
+    result.nombre_archivo = listing.contract.get("nombreArchivo")
+    if defer_scoring:
+        result.pending_file = fetch_contract_file(result.comercio_id, endpoint_1, headers_1, listing)
+        if result.pending_file is None:
+            apply_validation(result, NO_SIMILARITY, False)
+    else:
+        similarity, is_valid = compare_contract_file_to_example(result.comercio_id, endpoint_1, headers_1, listing)
+        apply_validation(result, similarity, is_valid)
+
+
+# Método para comparar en lote los archivos pendientes de un grupo de resultados.
+# Los archivos que no se pueden procesar quedan como no válidos
+def score_pending_results(results, batch_size):
+    """Scores every pending contract file against the example in batches."""
+    pending = [result for result in results if result.pending_file is not None]
+    if not pending:
+        return
+
+    similarities = get_instance().evaluate_batch_to_example(
+        [result.pending_file for result in pending],
+        batch_size=batch_size
+    )
+    for result, similarity in zip(pending, similarities):
+        result.pending_file = None
+        if similarity is None:
+            apply_validation(result, NO_SIMILARITY, False)
+        else:
+            apply_validation(result, similarity, True)
+
+
+# Método para registrar en el índice persistente los comercios cuyo contrato quedó
+# verificado (descargado y comparado), para no volver a revisarlos en otras ejecuciones
+def record_verified(results):
+    """Records the merchants with a verified contract in the verified-merchant index."""
+    verified_index = get_verified_index()
+    if verified_index is None:
+        return
+
+    verified_index.record(
+        {
+            "comercio": result.comercio_id,
+            "similitud": result.similitud,
+            "nivel": result.nivel,
+            "plantilla": result.plantilla,
+            "nombre_archivo": result.nombre_archivo
+        }
+        for result in results if result.contrato == "Si"
+    )
 
 
+# Método para registrar el resultado de un comercio en el journal apenas está completo,
+# para poder retomar si el proceso se cae a mitad de bloque. No se registran los que
+# esperan la comparación en lote (se registran después de compararlos) ni aquellos
+# cuya consulta falló (al retomar se vuelven a intentar)
+def journal_result(journal, result):
+    """Appends a finished MerchantResult to the journal, if there is one."""
+    if journal is None or result.pending_file is not None or result.outcome == "error_consulta":
+        return
+    journal.append(result.comercio_id, result.contrato, result.similitud, result.outcome, result.nivel, result.plantilla)
+
 
 # Método para procesar un bloque de largo definido del archivo de entrada
-# Esto permite ir parcelando el análisis en partes
-def process_block(df, start, end, endpoint_1, endpoint_2, headers_1, headers_2, log_file, block_size):
+# Esto permite ir parcelando el análisis en partes. Con max_workers > 1 los comercios
+# del bloque se procesan en paralelo (hasta max_workers a la vez). Con batch_size > 0
+# los contratos descargados en el bloque se comparan juntos, en lotes de ese tamaño.
+# Si se entrega un journal, cada resultado se registra en él y se omiten los comercios
+# que ya aparecen registrados (ejecución retomada)
+def process_block(df, start, end, endpoint_1, endpoint_2, headers_1, headers_2, log_file, block_size, max_workers=1, batch_size=0, journal=None):
     """Processes a block of rows from start to end."""
     
     # Variables para guardar mensajes y para el conteo de casos
@@ -198,69 +491,87 @@ def process_block(df, start, end, endpoint_1, endpoint_2, headers_1, headers_2,
     # Guardar mensaje de inicio de bloque
     log_entries.append(f"Procesando block  {start // block_size + 1}, desde la fila {start+1} a la {end}")
     
-    # Procesar el bloque hasta el final, cuidando que no se pase del tamaño de arreglo original
-    for index in range(start, min(end, len(df))):
-
-        # Obtener los valores para el comercio y estado de contrato por cada fila
-        comercio_id = df.loc[index, "Comercio"]
-        contrato = df.loc[index, "Contrato"]
-        
-        # Si el contrato ya está declarado, informar y continuar con la siguiente
-        if contrato == "Si":
-            print(f"Comercio {comercio_id} ya tiene contrato regularizado")
-            continue
-        
-        # Mensaje de contrato no encontrado y reparación
-        log_entries.append(f"Comercio {comercio_id} no tiene registro de contrato en sistema... reparando...")
-        
-        # Si no existe el contrato
-        if not check_contract(comercio_id, endpoint_1, headers_1):
-            print("contrato no encontrado, buscaremos reparar")
+    # Seleccionar las filas del bloque por etiqueta (así también funciona con partes de un
+    # archivo leído por trozos, que mantienen la numeración global), y separar con una
+    # máscara las que ya tienen el contrato declarado
+    block = df.loc[start:end - 1]
+    get_metrics().add_rows(len(block))
+    regularized = block["Contrato"] == "Si"
+    for comercio_id in block.loc[regularized, "Comercio"]:
+        show(f"Comercio {comercio_id} ya tiene contrato regularizado")
+    candidates = block.loc[~regularized]
+
+    # Si el comercio ya fue procesado (en una ejecución anterior, o en otra fila con el
+    # mismo ID), no repetirlo: copiar el resultado registrado en el journal
+    if journal is not None:
+        known = candidates["Comercio"].astype(str).isin(journal.entries)
+        for comercio_id in candidates.loc[known, "Comercio"].unique():
+            show(f"Comercio {comercio_id} ya fue procesado anteriormente")
+        journal.apply_to(df, candidates.index[known])
+        candidates = candidates.loc[~known]
+
+    # Si el contrato del comercio se verificó en otra ejecución y la verificación sigue
+    # vigente (índice persistente con TTL), copiar ese resultado sin llamar a los servicios
+    verified_index = get_verified_index()
+    if verified_index is not None and not candidates.empty:
+        verified = verified_index.apply_to(df, candidates.index)
+        for comercio_id, entry in verified.items():
+            show(f"Comercio {comercio_id} ya verificado el {verified_date(entry)}")
+        if verified:
+            log_entries.append(f"{len(verified)} comercios con contrato ya verificado en una ejecución anterior")
+        candidates = candidates.loc[~candidates["Comercio"].astype(str).isin(verified)]
+
+    # Agrupar las filas pendientes por comercio, para consultar una sola vez cada ID repetido
+    pending = candidates.groupby("Comercio", sort=False).groups
+
+    # Procesar los comercios pendientes, en secuencia o con un pool de hilos. Los resultados
+    # se asocian a su comercio (y por ende a sus filas), así que el orden de término no importa
+    results = {}
+    defer_scoring = batch_size > 0
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(process_merchant, comercio_id, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring): comercio_id
+                for comercio_id in pending
+            }
+            for future in as_completed(futures):
+                result = results[futures[future]] = future.result()
+                journal_result(journal, result)
+    else:
+        for comercio_id in pending:
+            result = results[comercio_id] = process_merchant(comercio_id, endpoint_1, endpoint_2, headers_1, headers_2, defer_scoring)
+            journal_result(journal, result)
+
+    # Comparar en lote los contratos descargados en el bloque, y registrar en el journal
+    # los resultados que quedaron completos con la comparación
+    if defer_scoring:
+        deferred = [result for result in results.values() if result.pending_file is not None]
+        score_pending_results(deferred, batch_size)
+        for result in deferred:
+            journal_result(journal, result)
+    record_verified(results.values())
+
+    # Escribir los resultados en las filas de cada comercio y actualizar los contadores
+    for comercio_id, rows in pending.items():
+        result = results[comercio_id]
+
+        if result.similitud is not None:
+            df.loc[rows, "Similitud"] = result.similitud
+        if result.contrato is not None:
+            df.loc[rows, "Contrato"] = result.contrato
+        if result.nivel is not None:
+            df.loc[rows, "Nivel"] = result.nivel
+        if result.plantilla is not None:
+            df.loc[rows, "Plantilla"] = result.plantilla
+
+        if result.outcome in ("reparado", "reparacion_fallida"):
             repairs_attempted += 1
-            
-            # Crear el contrato y revisar que quedó OK. Informar éxito o fracaso
-            if create_contract(comercio_id, endpoint_2, headers_2):
-                if double_check_contract(comercio_id, endpoint_1, headers_1):
-
-                    # Validar el archivo
-                    ratio, is_valid = compare_contract_file_to_example(comercio_id, endpoint_1, headers_1)
-                    df.loc[index, "Similitud"] = ratio
-                    
-                    if is_valid:
-                        # Marcar el contrato como existente
-                        df.loc[index, "Contrato"] = "Si"
-                        print("reparado correctamente")
-                        log_entries[-1] += " reparación exitosa"
-                        repairs_successful += 1
-                    else:
-                        df.loc[index, "Contrato"] = "No"
-                        print("la reparación falló")
-                        log_entries[-1] += " reparación sin éxito"
+        if result.outcome == "reparado":
+            repairs_successful += 1
+        if result.outcome == "mal_clasificado":
+            mistyped_cases += 1
 
-                
-                else:
-                    print("la reparación falló")
-                    log_entries[-1] += " reparación sin éxito"
-            else:
-                print("la reparación falló")
-                log_entries[-1] += " reparación sin éxito"
-
-        # Si el contrato ya existía, o sea, estaba mal clasificado, informar y actualizar estado en la fila
-        else:
-            # Validar el archivo
-            ratio, is_valid = compare_contract_file_to_example(comercio_id, endpoint_1, headers_1)
-            df.loc[index, "Similitud"] = ratio
-
-            if is_valid:
-                df.loc[index, "Contrato"] = "Si"
-                mistyped_cases += 1
-                print("contrato ya está registrado en los sistemas")
-                log_entries.append(f"El contrato del comercio {comercio_id} ya estaba guardado en los sistemas... OK!")
-
-            else:
-                df.loc[index, "Contrato"] = "No"
-                print(f"Error al descargar archivo para comercio {comercio_id}")
-                log_entries[-1] += f" Error al descargar archivo para comercio {comercio_id}"
+        log_entries.extend(result.log_entries)
     
     # Si a lo largo del bloque no hubo reparaciónes ni casos mal registrados, informar
     if repairs_attempted == 0 and mistyped_cases == 0:
@@ -270,6 +581,11 @@ def process_block(df, start, end, endpoint_1, endpoint_2, headers_1, headers_2,
     else:
         if mistyped_cases > 0:
             log_entries.append(f"En total habían {mistyped_cases} casos mal clasificados")
+
+    # Informar el límite de concurrencia con que terminó el bloque cada endpoint
+    summary = concurrency_summary()
+    if summary:
+        log_entries.append(summary)
     
     # Guardar en el archivo de log, sin sobre escribir
     with open(log_file, "a") as f:
@@ -277,43 +593,54 @@ def process_block(df, start, end, endpoint_1, endpoint_2, headers_1, headers_2,
     
     return repairs_attempted, repairs_successful, mistyped_cases
 
-def main():
+def main(argv=None):
 
-    # Cargar valores de ambiente para configuración
-    load_dotenv()
+    # Argumentos de línea de comandos
+    parser = argparse.ArgumentParser(description="Revisión y reparación de contratos de comercios")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="retomar una ejecución anterior, omitiendo los comercios ya registrados en el journal"
+    )
+    parser.add_argument(
+        "--no-prompt",
+        action="store_true",
+        help="no preguntar el tamaño de bloque ni pausar entre bloques (ejecución desatendida)"
+    )
+    args = parser.parse_args(argv)
 
-    # Valores globales para acceso, incluyendo bloque por defercto
-    # FILE_NAME = "ListaComercios.xlsx"
-    FILE_NAME = os.getenv("FILE_NAME")
-    # LOG_FILE = "processing_log.txt"
-    LOG_FILE = os.getenv("LOG_FILE")
-    # BLOCK_SIZE = 50
-    BLOCK_SIZE = int(os.getenv("BLOCK_SIZE"))
+    # Cargar valores de ambiente para configuración (los mismos para todas las formas de ejecución)
+    config = RunConfig.from_env()
 
     # Permite al usuario generar un tamaño de bloque personalizado
-    block = input(f"Definir el tamaño del bloque a analizar (default: {BLOCK_SIZE}): ")
-    if block:
-        BLOCK_SIZE = int(block)
+    if not args.no_prompt:
+        block = input(f"Definir el tamaño del bloque a analizar (default: {config.block_size}): ")
+        if block:
+            config.block_size = int(block)
 
     # Abre archivo de log y lo sobreescribe, para borrar los contenidos anteriores
-    with open(LOG_FILE, "w") as f:
-        f.write(f"Iniciando proceso de revisión. Tamaño de bloque: {BLOCK_SIZE}")
+    # (salvo que se esté retomando una ejecución anterior)
+    with open(config.log_file, "a" if args.resume else "w") as f:
+        f.write(f"Iniciando proceso de revisión. Tamaño de bloque: {config.block_size}, comercios en paralelo: {config.max_workers}\n")
     
-    # Endpoints de los servicios que usaremos
-    # ENDPOINT_1 = "https://api.vertical.multicaja.cl/sop/af/ayc/pdfs/generator/documents/files/"
-    ENDPOINT_1 = os.getenv("ENDPOINT_1")
-    # ENDPOINT_2 = "https://api.vertical.multicaja.cl/sop/af/ayc/pdfs/generator/documents/contract/operator/klap"
-    ENDPOINT_2 = os.getenv("ENDPOINT_2")
-
-    token_1 = os.getenv("TOKEN_1")
-    token_2 = os.getenv("TOKEN_2")
-    
-    # Headers de los servicios que usaremos. En realidad son el mismo, pero se podrían separar.
-    HEADERS_1 = {"Authorization": f"Bearer {token_1}"}
-    HEADERS_2 = {"Authorization": f"Bearer {token_2}"}
-    
-    # Leer datos de Excel de entrada
-    df = pd.read_excel(FILE_NAME)
+    # Métricas del proceso, escritas periódicamente si METRICS_JSON o METRICS_PROM están definidos
+    metrics = config.start_metrics()
+
+    # Opcionalmente, empezar a cargar el modelo de comparación mientras se lee el Excel.
+    # Si no, se carga recién con la primera comparación (o nunca, si no hace falta)
+    if os.getenv("WARM_UP_MODEL", "").lower() in ("1", "true", "si"):
+        warm_up()
+
+    # Leer datos de entrada. El Excel se lee completo, como una sola parte; CSV y Parquet
+    # se leen por trozos de CHUNK_SIZE filas, que se escriben al archivo de salida a medida
+    # que se terminan, para mantener acotada la memoria y empezar a procesar de inmediato
+    chunks = read_input(config.file_name, config.chunk_size)
+    writer = OutputWriter(config.file_name, config.output_file)
+
+    # Abrir el journal. Al retomar, a cada parte se le aplican los resultados ya registrados
+    journal = Journal(config.journal_file, resume=args.resume)
+    if args.resume:
+        print(f"Retomando ejecución: {len(journal.entries)} comercios ya procesados")
     
     # Variables de conteo globales para el análisis
     total_attempts = 0
@@ -322,51 +649,78 @@ def main():
     total_mistypes = 0
 
     total_cases = 0
+    interrupted = False
     
-    # Separar el análisis en bloques del tamaño definido por el usuario, o bien el default
-    for start in range(0, len(df), BLOCK_SIZE):
-        # Inicio y fin del bloque
-        end = start + BLOCK_SIZE
-        
-        # Mantener conteo de los bloques analizados
-        total_blocks += 1
-        
-        # Procesar bloque y traer las estadísticas. Sumarlas a los valores globales
-        attempts, successful, mistypes = process_block(df, start, end, ENDPOINT_1, ENDPOINT_2, HEADERS_1, HEADERS_2, LOG_FILE, BLOCK_SIZE)
-        total_attempts += attempts
-        total_successful += successful
-        total_mistypes += mistypes
-        
-        # Guardar los cambios en el Excel
-        df.to_excel(FILE_NAME, index=False)
+    for df, last_chunk in iter_with_last(chunks):
+        if args.resume:
+            journal.apply_to(df)
+
+        # Separar el análisis en bloques del tamaño definido por el usuario, o bien el default.
+        # Los bloques se identifican por el número de fila global (el índice de la parte)
+        chunk_start = df.index[0] if len(df) else 0
+        chunk_end = chunk_start + len(df)
+        for start in range(chunk_start, chunk_end, config.block_size):
+            # Si el usuario interrumpió, las partes restantes solo se copian a la salida
+            if interrupted:
+                break
 
-        # Si es el último bloque a analizar, tomar en cuenta para el total de los casos
-        if end >= len(df):
-            # This is wrong
-            total_cases = len(df)
-            break
+            # Inicio y fin del bloque
+            end = min(start + config.block_size, chunk_end)
+            
+            # Mantener conteo de los bloques analizados
+            total_blocks += 1
+            
+            # Procesar bloque y traer las estadísticas. Sumarlas a los valores globales
+            attempts, successful, mistypes = process_block(
+                df, start, end, config.endpoint_1, config.endpoint_2, config.headers_1, config.headers_2,
+                config.log_file, config.block_size, config.max_workers, config.batch_size, journal
+            )
+            total_attempts += attempts
+            total_successful += successful
+            total_mistypes += mistypes
+            total_cases += end - start
 
-        # De lo contrario, sumar el tamaño del bloque a la cantidad previa
-        total_cases += BLOCK_SIZE
-        
-        # Permitir al usuario la opción de continuar con el bloque siguiente
-        # Si la respuesta es "s", seguir, de lo contrario cerrar el ciclo
-        print("Continuar procesando el siguiente bloque? (s/n): ", end="", flush=True)
-        ready, _, _ = select.select([sys.stdin], [], [], 10)
-        if ready:
-            user_input = sys.stdin.readline().strip().lower()
-            if user_input != "s":
+            # Si es el último bloque a analizar (o la ejecución es desatendida), no preguntar
+            if last_chunk and end >= chunk_end:
                 break
+            if args.no_prompt:
+                continue
+            
+            # Permitir al usuario la opción de continuar con el bloque siguiente
+            # Si la respuesta es "s", seguir, de lo contrario cerrar el ciclo
+            print("Continuar procesando el siguiente bloque? (s/n): ", end="", flush=True)
+            ready, _, _ = select.select([sys.stdin], [], [], 10)
+            if ready:
+                user_input = sys.stdin.readline().strip().lower()
+                if user_input != "s":
+                    interrupted = True
+
+        # Escribir la parte al archivo de salida (las no procesadas quedan tal cual)
+        writer.write(df)
     
     # Escribir el mensaje de cierre, según si se procesó todo o quedó a medio camino
-    final_message = "Todos los registros se procesaron" if end >= len(df) else "Proceso incompleto, interrumpido por usuario"
+    final_message = "Proceso incompleto, interrumpido por usuario" if interrupted else "Todos los registros se procesaron"
     
     # Escribir los datos al log, con append (sin sobreescribir)
-    with open(LOG_FILE, "a") as f:
+    with open(config.log_file, "a") as f:
         f.write(f"{final_message}\nBloques totales: {total_blocks}, Total de filas analizadas: {total_cases}, Total de intentos de reparación: {total_attempts}, Total reparados: {total_successful}, Total mal clasificados: {total_mistypes}\n")
     
+    # Cerrar las conexiones HTTP reutilizadas durante el proceso y el pool de extracción de texto
+    close_sessions()
+    shutdown()
+
+    # Escribir las métricas finales
+    config.stop_metrics()
+
+    # Guardar los cambios en el Excel, una sola vez al final (el journal ya tiene cada resultado).
+    # Con entrada por trozos, la salida ya se fue escribiendo
+    journal.close()
+    writer.close()
+
     print(final_message)
     print(f"Bloques totales: {total_blocks}, Total filas analizadas: {total_cases}, Total intentos de reparación: {total_attempts}, Total reparaciones exitosas: {total_successful}, Total de casos mal clasificados: {total_mistypes}")
+    snapshot = metrics.snapshot()
+    print(f"Filas por segundo: {snapshot['rows_per_second']:.2f}, Comercios procesados: {snapshot['merchants']}, Máximo en paralelo: {snapshot['max_in_flight']}")
 
 
 def main_test():
@@ -400,15 +754,16 @@ def main_test():
     headers = {"Authorization": f"Bearer {token}"}
 
     # validate_contract_file(rut, endpoint=endpoint, headers=headers, payload=payload)
-    ratio, validated = compare_contract_file_to_example(
+    listing = DocumentListing(rut, ok=True, documents=[json.loads(payload)])
+    similarity, validated = compare_contract_file_to_example(
         rut,
         endpoint=endpoint,
         headers=headers,
-        payload=payload
+        listing=listing
     )
 
     if validated:
-        print(f"Archivo validado, coeficiente de similitud: {ratio}")
+        print(f"Archivo validado, coeficiente de similitud: {similarity.score} (nivel: {similarity.tier}, plantilla: {similarity.template})")
     else:
         print("No fue posible validar archivo")
 
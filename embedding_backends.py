@@ -0,0 +1,62 @@
+from typing import Optional
+
+# Backends disponibles para calcular los embeddings. Todos entregan un SentenceTransformer
+# (mismo encode), así que el resto del código no depende de cuál se use:
+# - "torch": el modelo tal cual (float32).
+# - "torch-int8": cuantización dinámica a int8 de las capas lineales (solo CPU).
+# - "onnx": ONNX Runtime sobre CPU.
+# - "onnx-int8": ONNX Runtime con un modelo cuantizado a int8.
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# Archivo del modelo cuantizado dentro del repositorio del modelo (hay variantes por
+# conjunto de instrucciones; avx2 es la que funciona en más CPUs)
+DEFAULT_ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+def load_embedding_model(
+    model_name: str,
+    backend: str = "torch",
+    threads: Optional[int] = None,
+    onnx_file: Optional[str] = None
+):
+    '''
+    Carga el modelo de embeddings con el backend indicado.
+
+    threads limita los hilos de cálculo (intra-op) del modelo, para que varios procesos
+    del pipeline en la misma máquina no compitan por los mismos núcleos. Con torch el
+    límite es para todo el proceso; con ONNX Runtime es para la sesión del modelo.
+    onnx_file permite elegir el archivo .onnx a usar (por ejemplo, otra variante int8).
+    '''
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Backend de embeddings no soportado: {backend} (opciones: {', '.join(EMBEDDING_BACKENDS)})")
+
+    # Importación diferida: sentence_transformers (y torch) tarda varios segundos en cargar
+    from sentence_transformers import SentenceTransformer
+
+    if backend.startswith("torch"):
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        if backend == "torch":
+            return SentenceTransformer(model_name)
+        model = SentenceTransformer(model_name, device="cpu")
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+
+    model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+    if onnx_file or backend == "onnx-int8":
+        model_kwargs["file_name"] = onnx_file or DEFAULT_ONNX_INT8_FILE
+
+    try:
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+    except TypeError as e:
+        # Versiones de sentence-transformers anteriores a 3.2 no tienen backends
+        raise ValueError(f"El backend {backend} requiere sentence-transformers 3.2 o superior: {e}")
@@ -0,0 +1,502 @@
+import mmap
+import os
+import tempfile
+import threading
+import time
+from itertools import chain
+from typing import Dict, Iterator, NamedTuple, Optional, Union
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader
+from urllib3.util.retry import Retry
+
+# Códigos de estado que se consideran transitorios y que se reintentan
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Códigos con los que el servicio indica que no procesó la solicitud por sobrecarga:
+# se pueden volver a enviar incluso si la operación no es idempotente
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+class ResponseTooLarge(Exception):
+    '''
+    La respuesta supera el tamaño máximo permitido para una descarga.
+    '''
+
+
+class DownloadLimits(NamedTuple):
+    '''
+    Límites de las descargas por streaming: tamaño máximo, tamaño desde el cual el
+    contenido se guarda en un archivo temporal (en vez de memoria) y tamaño de cada trozo.
+    '''
+    max_bytes: int
+    spool_bytes: int
+    chunk_bytes: int
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    '''
+    Adaptador HTTP que aplica un timeout por defecto a todas las solicitudes
+    que no indiquen uno explícitamente (requests.Session no lo permite por sí solo).
+    '''
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class RateLimiter():
+    '''
+    Limita la cantidad de operaciones por segundo entre todos los hilos (token bucket):
+    acquire() espera hasta que haya un token disponible. Con rate <= 0 no limita.
+    burst es la cantidad de operaciones que se pueden hacer seguidas tras un período sin uso.
+    '''
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter():
+    '''
+    Límite de solicitudes simultáneas a un endpoint, ajustado según cómo responde (AIMD):
+    cada respuesta sana sube el límite en 1/límite (del orden de +1 por ronda de
+    solicitudes), y un error (429, 5xx o falla de conexión) o una latencia anómala lo
+    multiplica por decrease. Solo se baja una vez por ronda: las solicitudes que ya
+    estaban en curso cuando se bajó no lo vuelven a bajar.
+
+    La latencia es anómala si supera latency_target segundos o, si no se define (0),
+    latency_factor veces la latencia típica observada (un promedio móvil de las
+    respuestas sin error, en el que las anómalas pesan menos).
+
+    Con breaker_failures errores seguidos se abre el circuito: acquire() espera (la etapa
+    queda en pausa) durante breaker_seconds. Después se deja pasar una sola solicitud de
+    prueba; si responde bien el circuito se cierra y el límite parte de nuevo del mínimo.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        initial: float = 4,
+        minimum: float = 1,
+        maximum: float = 32,
+        decrease: float = 0.5,
+        latency_target: float = 0.0,
+        latency_factor: float = 3.0,
+        breaker_failures: int = 5,
+        breaker_seconds: float = 30.0
+    ):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = min(self.maximum, max(minimum, initial))
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.latency_factor = latency_factor
+        self.breaker_failures = breaker_failures
+        self.breaker_seconds = breaker_seconds
+
+        self.state = "cerrado"
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.latency = None
+        self.samples = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        return 1 if self.state != "cerrado" else max(1, int(self.limit))
+
+    def acquire(self) -> float:
+        '''
+        Espera un cupo (y que el circuito no esté abierto) y retorna el instante de inicio,
+        que se debe entregar a release().
+        '''
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self.state == "abierto":
+                    if now < self.open_until:
+                        self._condition.wait(self.open_until - now)
+                        continue
+                    self.state = "prueba"
+                if self.in_flight < self.current_limit:
+                    self.in_flight += 1
+                    return now
+                self._condition.wait(1.0)
+
+    def release(self, started: float, ok: bool):
+        '''
+        Libera el cupo y ajusta el límite según el resultado de la solicitud.
+        '''
+        now = time.monotonic()
+        seconds = now - started
+        with self._condition:
+            self.in_flight -= 1
+            slow = ok and self._is_slow(seconds)
+
+            if ok:
+                self.failures = 0
+                if self.state == "prueba":
+                    self.state = "cerrado"
+                    self.limit = self.minimum
+                    print(f"Circuito de {self.name} cerrado, límite de concurrencia: {self.current_limit}")
+                elif not slow:
+                    self.limit = min(self.maximum, self.limit + 1 / max(1.0, self.limit))
+
+                # Las respuestas lentas también entran a la latencia típica, con menos peso:
+                # un pico aislado casi no la mueve, pero si el servicio se vuelve más lento
+                # de forma sostenida, la latencia típica lo alcanza y el límite vuelve a subir
+                weight = 0.02 if slow else 0.1
+                self.samples += 1
+                self.latency = seconds if self.latency is None else (1 - weight) * self.latency + weight * seconds
+            else:
+                self.failures += 1
+                if self.state == "prueba" or (self.state == "cerrado" and self.failures >= self.breaker_failures):
+                    self.state = "abierto"
+                    self.open_until = now + self.breaker_seconds
+                    print(f"Circuito de {self.name} abierto por {self.breaker_seconds:g} s "
+                          f"({self.failures} errores seguidos), etapa en pausa")
+
+            if (slow or not ok) and started >= self._last_decrease:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = now
+
+            self._condition.notify_all()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != "cerrado"
+
+    def _is_slow(self, seconds: float) -> bool:
+        if self.latency_target > 0:
+            return seconds > self.latency_target
+        return self.samples >= 10 and seconds > self.latency_factor * self.latency
+
+    def summary(self) -> str:
+        return f"{self.name}: {self.current_limit} (circuito {self.state})"
+
+
+class AdaptiveHTTPAdapter(TimeoutHTTPAdapter):
+    '''
+    Adaptador HTTP que pasa cada intento de una solicitud por el AdaptiveLimiter del
+    endpoint. Los reintentos por código de estado se hacen aquí y no en urllib3 (que
+    solo reintenta los errores de conexión y lectura), para que el límite vea cada
+    respuesta 429/5xx: se reintenta hasta status_retries veces, con backoff exponencial
+    o el tiempo que indique Retry-After, siempre que sea seguro repetir la solicitud
+    (métodos que se reintentan, o respuestas 429/503, que indican que el servicio no
+    la procesó). Las respuestas 429/503 se reintentan además max_pauses veces más, para
+    no dar por fallida una operación que el servicio ni siquiera intentó. Si otro error
+    persiste con el circuito abierto, en vez de retornarlo espera a que se cierre y
+    vuelve a enviar la solicitud (hasta max_pauses veces).
+    El cupo se libera al recibir los headers (las descargas por streaming leen el
+    cuerpo después).
+    '''
+
+    def __init__(
+        self,
+        *args,
+        limiter: AdaptiveLimiter,
+        max_pauses: int = 10,
+        status_retries: int = 3,
+        backoff_factor: float = 0.5,
+        **kwargs
+    ):
+        self.limiter = limiter
+        self.max_pauses = max_pauses
+        self.status_retries = status_retries
+        self.backoff_factor = backoff_factor
+        super().__init__(*args, **kwargs)
+
+    def _backoff(self, response, retries: int) -> float:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return self.max_retries.parse_retry_after(retry_after)
+            except InvalidHeader:
+                pass
+        # Sin Retry-After, el backoff no supera la pausa del circuito
+        return min(self.limiter.breaker_seconds, self.backoff_factor * 2 ** (retries - 1))
+
+    def send(self, request, **kwargs):
+        allowed_methods = self.max_retries.allowed_methods or ()
+        retries = 0
+        pauses = 0
+        while True:
+            started = self.limiter.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.limiter.release(started, ok=False)
+                safe = request.method in allowed_methods or isinstance(e, requests.exceptions.ConnectTimeout)
+                if safe and self.limiter.is_open and pauses < self.max_pauses:
+                    pauses += 1
+                    continue
+                raise
+            except BaseException:
+                # Cualquier otro error (headers inválidos, errores de urllib3, interrupción)
+                # también debe devolver el cupo, o el límite de concurrencia se va reduciendo
+                self.limiter.release(started, ok=False)
+                raise
+
+            ok = response.status_code not in RETRY_STATUS_CODES
+            self.limiter.release(started, ok=ok)
+            overloaded = response.status_code in OVERLOAD_STATUS_CODES
+            safe = request.method in allowed_methods or overloaded
+            if ok or not safe:
+                return response
+
+            # Reintentar con backoff. Las respuestas 429/503 se reintentan max_pauses veces
+            # más, esté o no abierto el circuito; las demás, agotados los reintentos, solo
+            # si el circuito está abierto (acquire espera a que se cierre)
+            if retries < self.status_retries + (self.max_pauses if overloaded else 0):
+                retries += 1
+                wait = self._backoff(response, retries)
+            elif self.limiter.is_open and pauses < self.max_pauses:
+                pauses += 1
+                wait = 0
+            else:
+                return response
+
+            # Leer la respuesta de error (pequeña) para devolver la conexión al pool
+            response.content
+            response.close()
+            time.sleep(wait)
+
+
+_sessions: Dict[str, requests.Session] = {}
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_sessions_lock = threading.Lock()
+
+
+def build_session(
+    retries: int = 3,
+    backoff_factor: float = 0.5,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 60.0,
+    pool_size: int = 10,
+    retry_post: bool = True,
+    limiter: Optional[AdaptiveLimiter] = None,
+    max_pauses: int = 10
+) -> requests.Session:
+    '''
+    Crea una sesión con pool de conexiones (keep-alive), timeout por defecto y
+    reintentos con backoff exponencial que respetan el header Retry-After.
+
+    Con retry_post=False los POST solo se reintentan ante errores de conexión
+    (antes de enviar la solicitud), nunca ante un 5xx o un error de lectura, para
+    no repetir operaciones que no son idempotentes.
+
+    Si se entrega un limiter, la concurrencia hacia el endpoint se ajusta con él y los
+    reintentos por código de estado los hace el adaptador, para que el límite los vea
+    (ver AdaptiveLimiter y AdaptiveHTTPAdapter).
+    '''
+    allowed_methods = set(Retry.DEFAULT_ALLOWED_METHODS)
+    if retry_post:
+        allowed_methods.add("POST")
+
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES if limiter is None else (),
+        allowed_methods=frozenset(allowed_methods),
+        respect_retry_after_header=limiter is None,
+        raise_on_status=False
+    )
+    adapter_options = {}
+    adapter_class = TimeoutHTTPAdapter
+    if limiter is not None:
+        adapter_class = AdaptiveHTTPAdapter
+        adapter_options = {"limiter": limiter, "max_pauses": max_pauses, "status_retries": retries, "backoff_factor": backoff_factor}
+    adapter = adapter_class(
+        timeout=(connect_timeout, read_timeout),
+        max_retries=retry,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        **adapter_options
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(endpoint: str, retry_post: Optional[bool] = None) -> requests.Session:
+    '''
+    Retorna la sesión compartida para un endpoint, creándola en el primer uso.
+    La configuración se lee de las variables de ambiente HTTP_RETRIES, HTTP_BACKOFF,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT y HTTP_POOL_SIZE.
+
+    Salvo que HTTP_ADAPTIVE=0, cada endpoint tiene su límite de concurrencia adaptativo
+    (ver adaptive_limiter).
+
+    retry_post solo tiene efecto al crear la sesión (por defecto True).
+    '''
+    session = _sessions.get(endpoint)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        if endpoint not in _sessions:
+            load_dotenv()
+            pool_size = int(os.getenv("HTTP_POOL_SIZE", max(10, int(os.getenv("MAX_WORKERS", "1")))))
+            limiter = None
+            if os.getenv("HTTP_ADAPTIVE", "1").lower() not in ("0", "false", "no"):
+                limiter = _limiters[endpoint] = adaptive_limiter(endpoint, pool_size)
+            _sessions[endpoint] = build_session(
+                retries=int(os.getenv("HTTP_RETRIES", "3")),
+                backoff_factor=float(os.getenv("HTTP_BACKOFF", "0.5")),
+                connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+                read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "60")),
+                pool_size=pool_size,
+                retry_post=True if retry_post is None else retry_post,
+                limiter=limiter,
+                max_pauses=int(os.getenv("HTTP_BREAKER_MAX_PAUSES", "10"))
+            )
+        return _sessions[endpoint]
+
+
+def adaptive_limiter(endpoint: str, pool_size: int) -> AdaptiveLimiter:
+    '''
+    Crea el límite adaptativo de un endpoint según HTTP_CONCURRENCY_MIN (por defecto 1),
+    HTTP_CONCURRENCY_INITIAL (4), HTTP_CONCURRENCY_MAX (el tamaño del pool), HTTP_DECREASE
+    (0.5), HTTP_LATENCY_TARGET (0 = automático), HTTP_LATENCY_FACTOR (3),
+    HTTP_BREAKER_FAILURES (5) y HTTP_BREAKER_SECONDS (30).
+    '''
+    return AdaptiveLimiter(
+        endpoint,
+        initial=float(os.getenv("HTTP_CONCURRENCY_INITIAL", "4")),
+        minimum=float(os.getenv("HTTP_CONCURRENCY_MIN", "1")),
+        maximum=float(os.getenv("HTTP_CONCURRENCY_MAX", str(pool_size))),
+        decrease=float(os.getenv("HTTP_DECREASE", "0.5")),
+        latency_target=float(os.getenv("HTTP_LATENCY_TARGET", "0")),
+        latency_factor=float(os.getenv("HTTP_LATENCY_FACTOR", "3")),
+        breaker_failures=int(os.getenv("HTTP_BREAKER_FAILURES", "5")),
+        breaker_seconds=float(os.getenv("HTTP_BREAKER_SECONDS", "30"))
+    )
+
+
+def concurrency_summary() -> Optional[str]:
+    '''
+    Límite de concurrencia actual de cada endpoint (para el log), o None si no hay ninguno.
+    También se publica como métrica.
+    '''
+    from metrics import get_metrics
+
+    with _sessions_lock:
+        limiters = list(_limiters.values())
+    if not limiters:
+        return None
+
+    metrics = get_metrics()
+    for limiter in limiters:
+        metrics.set_gauge("concurrency_limit", limiter.current_limit, endpoint=limiter.name)
+        metrics.set_gauge("circuit_open", int(limiter.is_open), endpoint=limiter.name)
+    return "Límite de concurrencia por endpoint: " + ", ".join(limiter.summary() for limiter in limiters)
+
+
+def close_sessions():
+    '''
+    Cierra todas las sesiones abiertas (y sus conexiones).
+    '''
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _limiters.clear()
+
+
+def download_limits() -> DownloadLimits:
+    '''
+    Límites de descarga según DOWNLOAD_MAX_MB (por defecto 100), DOWNLOAD_SPOOL_MB
+    (por defecto 8) y DOWNLOAD_CHUNK_KB (por defecto 64).
+    '''
+    load_dotenv()
+    return DownloadLimits(
+        max_bytes=int(float(os.getenv("DOWNLOAD_MAX_MB", "100")) * 1024 * 1024),
+        spool_bytes=int(float(os.getenv("DOWNLOAD_SPOOL_MB", "8")) * 1024 * 1024),
+        chunk_bytes=int(float(os.getenv("DOWNLOAD_CHUNK_KB", "64")) * 1024)
+    )
+
+
+def read_limited(first_chunk: bytes, chunks: Iterator[bytes], max_bytes: int) -> bytes:
+    '''
+    Lee en memoria el resto de una respuesta por streaming (ya leído su primer trozo).
+    Lanza ResponseTooLarge si supera max_bytes.
+    '''
+    parts = []
+    size = 0
+    for chunk in chain([first_chunk], chunks):
+        size += len(chunk)
+        if size > max_bytes:
+            raise ResponseTooLarge(f"La respuesta supera {max_bytes} bytes")
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def spool_content(first_chunk: bytes, chunks: Iterator[bytes], limits: DownloadLimits) -> Union[bytes, mmap.mmap]:
+    '''
+    Lee el resto de una respuesta por streaming (ya leído su primer trozo), sin pasar de
+    limits.max_bytes (lanza ResponseTooLarge). Mientras el contenido es pequeño se junta en
+    memoria y se retorna como bytes; si supera limits.spool_bytes se sigue escribiendo a un
+    archivo temporal anónimo, que se retorna mapeado en memoria (mmap, solo lectura): las
+    páginas las maneja el sistema operativo y se pueden leer sin otra copia.
+    '''
+    parts = []
+    size = 0
+    for chunk in chain([first_chunk], chunks):
+        size += len(chunk)
+        if size > limits.max_bytes:
+            raise ResponseTooLarge(f"La respuesta supera {limits.max_bytes} bytes")
+        parts.append(chunk)
+
+        if size > limits.spool_bytes:
+            return _spool_to_file(parts, chunks, size, limits.max_bytes)
+
+    return b"".join(parts)
+
+
+def _spool_to_file(parts, chunks, size, max_bytes) -> mmap.mmap:
+    with tempfile.TemporaryFile() as spool:
+        for part in parts:
+            spool.write(part)
+        parts.clear()
+
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ResponseTooLarge(f"La respuesta supera {max_bytes} bytes")
+            spool.write(chunk)
+
+        spool.flush()
+        # El mapeo sigue siendo válido después de cerrar (y borrar) el archivo temporal
+        return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,185 @@
+import os
+from typing import Iterator, Optional
+import pandas as pd
+
+# Formatos de entrada que se pueden leer por trozos (el Excel siempre se lee completo)
+STREAMING_EXTENSIONS = (".csv", ".parquet")
+
+
+def is_streaming_input(file_name: str) -> bool:
+    return os.path.splitext(file_name)[1].lower() in STREAMING_EXTENSIONS
+
+
+def read_input_chunks(file_name: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    '''
+    Lee la lista de comercios por trozos de chunk_size filas, desde CSV o Parquet.
+    Cada trozo mantiene la numeración global de filas en su índice, de modo que los
+    bloques se pueden seguir identificando por fila como con el Excel completo.
+    La columna "Comercio" se lee siempre como texto (los RUT llevan dígito verificador).
+    '''
+    extension = os.path.splitext(file_name)[1].lower()
+
+    if extension == ".csv":
+        # read_csv por trozos ya continúa la numeración del índice entre trozos
+        yield from pd.read_csv(file_name, chunksize=chunk_size, dtype={"Comercio": str})
+
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+
+        offset = 0
+        for batch in pq.ParquetFile(file_name).iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            chunk["Comercio"] = chunk["Comercio"].astype(str)
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+
+    else:
+        raise ValueError(f"Formato de entrada no soportado para lectura por trozos: {file_name}")
+
+
+def read_input(file_name: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    '''
+    Lee la lista de comercios por partes: el Excel completo, como una sola parte; CSV y
+    Parquet por trozos de chunk_size filas, ya preparados con prepare_chunk.
+    '''
+    if is_streaming_input(file_name):
+        for chunk in read_input_chunks(file_name, chunk_size):
+            yield prepare_chunk(chunk)
+    else:
+        yield pd.read_excel(file_name)
+
+
+def count_input_rows(file_name: str) -> int:
+    '''
+    Cantidad de filas de la lista de comercios (sin contar el encabezado).
+    '''
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(file_name).metadata.num_rows
+    if extension == ".csv":
+        return sum(len(chunk) for chunk in pd.read_csv(file_name, chunksize=100000, usecols=[0]))
+    return len(pd.read_excel(file_name, usecols=[0]))
+
+
+def prepare_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Asegura que un trozo tenga las columnas de resultado con tipos fijos, para que todos
+    los trozos escritos a la salida tengan el mismo esquema.
+    '''
+    if "Similitud" not in chunk:
+        chunk["Similitud"] = float("nan")
+    chunk["Similitud"] = chunk["Similitud"].astype("float64")
+
+    for column in ("Nivel", "Plantilla"):
+        if column not in chunk:
+            chunk[column] = pd.Series(pd.NA, index=chunk.index, dtype="string")
+        else:
+            chunk[column] = chunk[column].astype("string")
+    return chunk
+
+
+def iter_with_last(iterable):
+    '''
+    Recorre un iterable entregando (elemento, es_el_último), leyendo un elemento adelantado.
+    '''
+    iterator = iter(iterable)
+    try:
+        current = next(iterator)
+    except StopIteration:
+        return
+    for following in iterator:
+        yield current, False
+        current = following
+    yield current, True
+
+
+class ChunkWriter():
+    '''
+    Escribe los trozos ya procesados a un archivo de salida CSV o Parquet, uno tras otro,
+    sin mantener en memoria el archivo completo.
+    '''
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.extension = os.path.splitext(file_name)[1].lower()
+        self._parquet_writer = None
+        self._rows = 0
+
+    def write(self, chunk: pd.DataFrame):
+        if self.extension == ".csv":
+            chunk.to_csv(self.file_name, mode="w" if self._rows == 0 else "a", header=self._rows == 0, index=False)
+
+        elif self.extension == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.file_name, table.schema)
+            else:
+                # Las columnas agregadas durante el proceso pueden faltar en algunos trozos
+                table = table.select([name for name in self._parquet_writer.schema.names if name in table.column_names])
+                table = self._align(table, self._parquet_writer.schema)
+            self._parquet_writer.write_table(table)
+
+        else:
+            raise ValueError(f"Formato de salida no soportado para escritura por trozos: {self.file_name}")
+
+        self._rows += len(chunk)
+
+    @staticmethod
+    def _align(table, schema):
+        '''
+        Ajusta un trozo al esquema del archivo: agrega como nulas las columnas que faltan
+        y convierte los tipos.
+        '''
+        import pyarrow as pa
+
+        for field in schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field, pa.nulls(len(table), type=field.type))
+        return table.select(schema.names).cast(schema)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+
+class OutputWriter():
+    '''
+    Escribe la lista de comercios procesada, parte por parte (las partes de read_input).
+    Con entrada CSV o Parquet cada parte se escribe a output_file apenas se entrega; el
+    Excel se reescribe una sola vez, al cerrar.
+    '''
+
+    def __init__(self, file_name: str, output_file: str):
+        self.file_name = file_name
+        self._writer = ChunkWriter(output_file) if is_streaming_input(file_name) else None
+        self._df: Optional[pd.DataFrame] = None
+
+    def write(self, df: pd.DataFrame):
+        if self._writer is not None:
+            self._writer.write(df)
+        else:
+            self._df = df
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        elif self._df is not None:
+            export_excel(self._df, self.file_name)
+
+
+def export_excel(df, file_name):
+    '''
+    Escribe el DataFrame a Excel a través de un archivo temporal, para que una caída
+    durante la escritura no corrompa el archivo original.
+    '''
+    base, extension = os.path.splitext(file_name)
+    temp_file = f"{base}.tmp{extension}"
+    df.to_excel(temp_file, index=False)
+    os.replace(temp_file, file_name)
@@ -0,0 +1,93 @@
+import datetime
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+
+class Journal():
+    '''
+    Registro append-only (una línea JSON por comercio) de los resultados del proceso.
+    Permite retomar una ejecución interrumpida sin reescribir el archivo de entrada
+    después de cada bloque: al final se exporta una sola vez.
+    '''
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+
+        # Al retomar se cargan las entradas existentes; si no, se parte de cero
+        self.entries: Dict[str, dict] = self.load(path) if resume else {}
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    @staticmethod
+    def load(path: str) -> Dict[str, dict]:
+        '''
+        Lee un journal existente y retorna la última entrada de cada comercio.
+        Las líneas incompletas (por ejemplo, por una caída a mitad de escritura) se ignoran.
+        '''
+        entries = {}
+        if not os.path.exists(path):
+            return entries
+
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[str(entry["comercio"])] = entry
+        return entries
+
+    def has(self, comercio_id) -> bool:
+        return str(comercio_id) in self.entries
+
+    def append(
+        self,
+        comercio_id,
+        contrato: Optional[str],
+        similitud: Optional[float],
+        outcome: str,
+        nivel: Optional[str] = None,
+        plantilla: Optional[str] = None
+    ):
+        '''
+        Agrega el resultado de un comercio al journal y lo escribe inmediatamente.
+        '''
+        entry = {
+            "comercio": str(comercio_id),
+            "contrato": contrato,
+            "similitud": similitud,
+            "outcome": outcome,
+            "nivel": nivel,
+            "plantilla": plantilla,
+            "fecha": datetime.datetime.now().isoformat(timespec="seconds")
+        }
+        with self._lock:
+            self.entries[entry["comercio"]] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def apply_to(self, df, rows=None):
+        '''
+        Copia los resultados registrados a las filas correspondientes del DataFrame
+        (o solo a las filas indicadas en rows).
+        '''
+        comercios = df["Comercio"] if rows is None else df.loc[rows, "Comercio"]
+        comercios = comercios.astype(str)
+        comercios = comercios[comercios.isin(self.entries)]
+        if comercios.empty:
+            return
+
+        columns = (("Similitud", "similitud"), ("Contrato", "contrato"), ("Nivel", "nivel"), ("Plantilla", "plantilla"))
+        for column, key in columns:
+            values = comercios.map(lambda comercio_id: self.entries[comercio_id].get(key)).dropna()
+            if not values.empty:
+                df.loc[values.index, column] = values
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
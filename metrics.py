@@ -0,0 +1,268 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# Límites (en segundos) de los buckets del histograma de latencia por etapa
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefijo de las métricas exportadas en formato Prometheus
+PROMETHEUS_PREFIX = "contratos"
+
+
+class StageStats():
+    '''
+    Latencias observadas para una etapa del proceso: conteo, suma, mínimo, máximo,
+    histograma por buckets y una muestra acotada (reservoir sampling) para percentiles.
+    '''
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_samples: int = 5000):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.max_samples = max_samples
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+        for position, limit in enumerate(self.buckets):
+            if seconds <= limit:
+                self.bucket_counts[position] += 1
+
+        if len(self.samples) < self.max_samples:
+            self.samples.append(seconds)
+        else:
+            position = random.randrange(self.count)
+            if position < self.max_samples:
+                self.samples[position] = seconds
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            "max": self.max
+        }
+
+
+class Metrics():
+    '''
+    Métricas del proceso: latencia por etapa, filas y comercios procesados (y su tasa
+    por segundo) y cantidad de comercios en proceso simultáneamente.
+    Se pueden exportar periódicamente a un resumen JSON y a un archivo de texto para
+    el textfile collector de Prometheus.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stages: Dict[str, StageStats] = {}
+        self.rows = 0
+        self.merchants = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.gauges: Dict[tuple, float] = {}
+        self._exporter: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageStats()
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        '''
+        Mide la duración del bloque de código como una observación de la etapa name.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def merchant(self):
+        '''
+        Registra un comercio en proceso (en vuelo) mientras dura el bloque de código,
+        y su duración total como la etapa "merchant".
+        '''
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            with self.stage("merchant"):
+                yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.merchants += 1
+
+    def set_gauge(self, name: str, value: float, **labels):
+        '''
+        Registra el valor actual de una métrica (por ejemplo, el límite de concurrencia de un endpoint).
+        '''
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_rows(self, count: int):
+        with self._lock:
+            self.rows += count
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "elapsed_seconds": elapsed,
+                "rows": self.rows,
+                "rows_per_second": self.rows / elapsed if elapsed > 0 else 0.0,
+                "merchants": self.merchants,
+                "merchants_per_second": self.merchants / elapsed if elapsed > 0 else 0.0,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "stages": {name: stats.summary() for name, stats in self.stages.items()},
+                "gauges": {_gauge_key(name, labels): value for (name, labels), value in self.gauges.items()}
+            }
+
+    def prometheus_text(self) -> str:
+        '''
+        Métricas en el formato de texto de Prometheus.
+        '''
+        snapshot = self.snapshot()
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {prefix}_rows_total Filas analizadas",
+            f"# TYPE {prefix}_rows_total counter",
+            f"{prefix}_rows_total {snapshot['rows']}",
+            f"# HELP {prefix}_merchants_total Comercios procesados (chequeo, reparación y validación)",
+            f"# TYPE {prefix}_merchants_total counter",
+            f"{prefix}_merchants_total {snapshot['merchants']}",
+            f"# HELP {prefix}_rows_per_second Filas analizadas por segundo desde el inicio",
+            f"# TYPE {prefix}_rows_per_second gauge",
+            f"{prefix}_rows_per_second {snapshot['rows_per_second']}",
+            f"# HELP {prefix}_in_flight Comercios en proceso",
+            f"# TYPE {prefix}_in_flight gauge",
+            f"{prefix}_in_flight {snapshot['in_flight']}",
+            f"# HELP {prefix}_stage_seconds Latencia por etapa",
+            f"# TYPE {prefix}_stage_seconds histogram"
+        ]
+        with self._lock:
+            for name, stats in self.stages.items():
+                for limit, count in zip(stats.buckets, stats.bucket_counts):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{limit}"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stats.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stats.total}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats.count}')
+            for name in sorted(set(name for name, _ in self.gauges)):
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                for (gauge, labels), value in self.gauges.items():
+                    if gauge == name:
+                        lines.append(f"{prefix}_{_gauge_key(name, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        '''
+        Escribe el resumen JSON y/o el archivo de Prometheus (de forma atómica, para que
+        el lector nunca vea un archivo a medio escribir).
+        '''
+        if json_path:
+            _write_atomic(json_path, json.dumps(self.snapshot(), indent=2))
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.prometheus_text())
+
+    def start_exporter(self, json_path: Optional[str], prometheus_path: Optional[str], interval: float):
+        '''
+        Inicia un hilo que escribe las métricas cada interval segundos.
+        '''
+        if not json_path and not prometheus_path:
+            return
+
+        def export():
+            while not self._stop.wait(interval):
+                self.write(json_path, prometheus_path)
+
+        self._exporter = threading.Thread(target=export, name="metrics-exporter", daemon=True)
+        self._exporter.start()
+
+    def stop_exporter(self):
+        self._stop.set()
+        if self._exporter is not None:
+            self._exporter.join()
+            self._exporter = None
+
+
+def _gauge_key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _write_atomic(path, content):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+_metrics_instance: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> Metrics:
+
+    global _metrics_instance
+
+    if _metrics_instance is None:
+        with _metrics_lock:
+            if _metrics_instance is None:
+                _metrics_instance = Metrics()
+
+    return _metrics_instance
+
+
+def reset_metrics() -> Metrics:
+    '''
+    Reemplaza las métricas compartidas por unas nuevas (por ejemplo, entre corridas de benchmark).
+    '''
+    global _metrics_instance
+
+    with _metrics_lock:
+        _metrics_instance = Metrics()
+
+    return _metrics_instance
+
+
+# Mensajes por fila en consola. Se pueden desactivar (QUIET=1) para no frenar el proceso
+_quiet: Optional[bool] = None
+
+def show(*args, **kwargs):
+    '''
+    Igual que print, salvo que los mensajes por fila estén desactivados con QUIET.
+    '''
+    global _quiet
+
+    if _quiet is None:
+        load_dotenv()
+        _quiet = os.getenv("QUIET", "").lower() in ("1", "true", "si")
+    if not _quiet:
+        print(*args, **kwargs)
@@ -0,0 +1,131 @@
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+# Constantes del mezclador splitmix64, usado como familia de funciones de hash de MinHash
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    # Las multiplicaciones de arreglos uint64 dan la vuelta módulo 2^64, como se necesita
+    values = (values ^ (values >> np.uint64(30))) * _MIX_1
+    values = (values ^ (values >> np.uint64(27))) * _MIX_2
+    return values ^ (values >> np.uint64(31))
+
+
+class NearDuplicateIndex():
+    '''
+    Índice de documentos casi idénticos (MinHash con LSH por bandas) sobre el texto
+    extraído de los contratos, para reutilizar el coeficiente de un documento ya evaluado
+    en vez de volver a calcular su embedding.
+
+    Cada texto se representa por sus shingles (secuencias de shingle_size palabras) y su
+    firma MinHash de bands * rows valores. Dos documentos caen en un mismo bucket si
+    coinciden en todos los valores de alguna banda (con 32 bandas de 4 valores, casi
+    seguro desde una similitud Jaccard de 0,6); como verificación barata, se acepta
+    el grupo (cluster) solo si la similitud Jaccard estimada con su representante (la
+    fracción de valores iguales de la firma) es al menos threshold.
+
+    Los clusters guardan un valor (el resultado de la evaluación del representante),
+    que queda en None mientras se calcula. Se guardan como máximo max_clusters clusters:
+    después solo se buscan coincidencias con los ya existentes.
+    '''
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        bands: int = 32,
+        rows: int = 4,
+        shingle_size: int = 5,
+        max_clusters: int = 100000,
+        seed: int = 1
+    ):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+        self.max_clusters = max_clusters
+
+        # Una semilla por función de hash de la firma
+        rng = np.random.RandomState(seed)
+        self._seeds = rng.randint(0, 1 << 63, size=bands * rows, dtype=np.int64).astype(np.uint64)
+
+        self._lock = threading.Lock()
+        self._signatures: List[np.ndarray] = []
+        self._values: List[Any] = []
+        self._buckets: Dict[tuple, int] = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def shingles(self, text: str) -> set:
+        words = text.lower().split()
+        if len(words) <= self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {
+            " ".join(words[position:position + self.shingle_size])
+            for position in range(len(words) - self.shingle_size + 1)
+        }
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        '''
+        Firma MinHash de un texto, o None si el texto no tiene palabras.
+        '''
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        # Una fila por función de hash; el mínimo de cada fila es un valor de la firma
+        return _mix64(self._seeds[:, None] ^ hashes[None, :]).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+
+    def find(self, signature: np.ndarray) -> Optional[int]:
+        '''
+        Cluster de un documento casi idéntico al de la firma, o None si no hay.
+        '''
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                cluster = self._buckets.get(key)
+                if cluster is not None:
+                    candidates.add(cluster)
+
+            best, best_similarity = None, self.threshold
+            for cluster in candidates:
+                similarity = float(np.mean(self._signatures[cluster] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = cluster, similarity
+            return best
+
+    def add(self, signature: np.ndarray, value: Any = None) -> Optional[int]:
+        '''
+        Crea un cluster con la firma como representante. Retorna su número, o None si
+        el índice está lleno.
+        '''
+        with self._lock:
+            if len(self._signatures) >= self.max_clusters:
+                return None
+            cluster = len(self._signatures)
+            self._signatures.append(signature)
+            self._values.append(value)
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, cluster)
+            return cluster
+
+    def value(self, cluster: int) -> Any:
+        with self._lock:
+            return self._values[cluster]
+
+    def set_value(self, cluster: int, value: Any):
+        with self._lock:
+            self._values[cluster] = value
@@ -0,0 +1,82 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+from dotenv import load_dotenv
+
+from metrics import Metrics, get_metrics
+
+
+@dataclass
+class RunConfig:
+    '''
+    Configuración común a las formas de ejecutar la revisión (main, dos fases y shards),
+    leída de las variables de ambiente (o del archivo .env).
+    '''
+    file_name: str
+    log_file: str
+    output_file: str
+    journal_file: str
+    block_size: int
+    max_workers: int
+    batch_size: int
+    chunk_size: int
+    endpoint_1: Optional[str]
+    endpoint_2: Optional[str]
+    headers_1: dict
+    headers_2: dict
+    metrics_json: Optional[str]
+    metrics_prom: Optional[str]
+    metrics_interval: float
+
+    @classmethod
+    def from_env(cls) -> "RunConfig":
+        load_dotenv()
+
+        # FILE_NAME = "ListaComercios.xlsx"
+        file_name = os.getenv("FILE_NAME")
+        # Con entrada CSV o Parquet, la salida se escribe a OUTPUT_FILE (el Excel se reescribe)
+        base_name, extension = os.path.splitext(file_name)
+
+        return cls(
+            file_name=file_name,
+            # LOG_FILE = "processing_log.txt"
+            log_file=os.getenv("LOG_FILE"),
+            output_file=os.getenv("OUTPUT_FILE", f"{base_name}_resultado{extension}"),
+            # Journal con los resultados por comercio (permite retomar con --resume)
+            journal_file=os.getenv("JOURNAL_FILE", f"{file_name}.journal.jsonl"),
+            # BLOCK_SIZE = 50
+            block_size=int(os.getenv("BLOCK_SIZE")),
+            # Cantidad de comercios que se procesan en paralelo dentro de un bloque (1 = secuencial)
+            max_workers=int(os.getenv("MAX_WORKERS", "1")),
+            # Tamaño de lote para comparar los contratos de un bloque juntos (0 = uno por uno)
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "0")),
+            # Lectura por trozos (solo para entradas CSV o Parquet)
+            chunk_size=int(os.getenv("CHUNK_SIZE", "10000")),
+            # ENDPOINT_1 = "https://api.vertical.multicaja.cl/sop/af/ayc/pdfs/generator/documents/files/"
+            endpoint_1=os.getenv("ENDPOINT_1"),
+            # ENDPOINT_2 = "https://api.vertical.multicaja.cl/sop/af/ayc/pdfs/generator/documents/contract/operator/klap"
+            endpoint_2=os.getenv("ENDPOINT_2"),
+            # Headers de los servicios que usaremos. En realidad son el mismo, pero se podrían separar.
+            headers_1={"Authorization": f"Bearer {os.getenv('TOKEN_1')}"},
+            headers_2={"Authorization": f"Bearer {os.getenv('TOKEN_2')}"},
+            # Métricas del proceso: resumen JSON y archivo para Prometheus, escritos cada METRICS_INTERVAL segundos
+            metrics_json=os.getenv("METRICS_JSON"),
+            metrics_prom=os.getenv("METRICS_PROM"),
+            metrics_interval=float(os.getenv("METRICS_INTERVAL", "15"))
+        )
+
+    def start_metrics(self) -> Metrics:
+        '''
+        Inicia la exportación periódica de las métricas del proceso y las retorna.
+        '''
+        metrics = get_metrics()
+        metrics.start_exporter(self.metrics_json, self.metrics_prom, self.metrics_interval)
+        return metrics
+
+    def stop_metrics(self):
+        '''
+        Detiene la exportación periódica y escribe las métricas finales.
+        '''
+        metrics = get_metrics()
+        metrics.stop_exporter()
+        metrics.write(self.metrics_json, self.metrics_prom)
@@ -0,0 +1,553 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+import pandas as pd
+
+from compare import shutdown
+from correccion_contratos import process_block
+from http_client import close_sessions
+from input_files import OutputWriter, count_input_rows, prepare_chunk, read_input
+from journal import Journal
+from run_config import RunConfig
+
+# Columnas de resultado que cada shard entrega y que se copian a la salida al unir
+RESULT_COLUMNS = ("Contrato", "Similitud", "Nivel", "Plantilla")
+
+# Contadores por shard (los mismos que main informa al final)
+COUNTERS = ("rows", "blocks", "attempts", "successful", "mistypes")
+
+
+# Una parte de la lista de comercios (los comercios cuyo ID cae en shard_id de shard_count),
+# asignada a un worker mientras tenga su lease
+@dataclass
+class Shard:
+    shard_id: int
+    shard_count: int
+    attempts: int
+
+
+def shard_of(comercio_id, shard_count: int) -> int:
+    '''
+    Shard de un comercio, según un hash estable de su ID: todas las filas de un mismo
+    comercio caen en el mismo shard, así que se consulta (y se repara) una sola vez.
+    '''
+    return zlib.crc32(str(comercio_id).encode("utf-8")) % shard_count
+
+
+class LeaseLost(Exception):
+    '''
+    El worker perdió el lease del shard que procesaba (otro worker lo puede haber retomado).
+    '''
+
+
+class ShardStore():
+    '''
+    Registro de shards en SQLite, compartido por los workers (procesos de la misma máquina,
+    o de varias máquinas sobre un sistema de archivos compartido con locks confiables).
+
+    Cada worker toma un shard pendiente con un lease de duración limitada, que renueva
+    mientras lo procesa. Si el worker se cae, el lease expira y otro worker retoma el shard.
+    Un shard que falla max_attempts veces queda como "failed".
+    '''
+
+    META_TABLE = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+    SHARDS_TABLE = """
+        CREATE TABLE IF NOT EXISTS shards (
+            shard_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            rows INTEGER NOT NULL DEFAULT 0,
+            blocks INTEGER NOT NULL DEFAULT 0,
+            repairs_attempted INTEGER NOT NULL DEFAULT 0,
+            repairs_successful INTEGER NOT NULL DEFAULT 0,
+            mistypes INTEGER NOT NULL DEFAULT 0
+        )
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as connection:
+            connection.execute(self.META_TABLE)
+            connection.execute(self.SHARDS_TABLE)
+
+    def _connect(self):
+        # Una conexión por operación: se puede usar desde varios hilos y procesos.
+        # Las transacciones de escritura se abren con BEGIN IMMEDIATE para tomar el lock al inicio
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def create(self, file_name: str, shard_count: int):
+        '''
+        Divide la lista en shard_count shards por ID de comercio (reemplaza los anteriores).
+        '''
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            # La tabla se vuelve a crear, por si viene de una versión con otras columnas
+            connection.execute("DROP TABLE shards")
+            connection.execute(self.SHARDS_TABLE)
+            connection.execute("DELETE FROM meta")
+            connection.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("file_name", file_name), ("shard_count", str(shard_count))]
+            )
+            connection.executemany("INSERT INTO shards (shard_id) VALUES (?)", [(shard_id,) for shard_id in range(shard_count)])
+            connection.execute("COMMIT")
+
+    def _meta(self, key: str) -> Optional[str]:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def file_name(self) -> Optional[str]:
+        return self._meta("file_name")
+
+    @property
+    def shard_count(self) -> int:
+        return int(self._meta("shard_count") or 0)
+
+    def lease(self, owner: str, lease_seconds: float) -> Optional[Shard]:
+        '''
+        Toma el primer shard pendiente (o con el lease vencido) para owner.
+        Retorna None si no hay shards disponibles en este momento.
+        '''
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                """
+                SELECT shard_id, attempts FROM shards
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?)) AND attempts < ?
+                ORDER BY shard_id LIMIT 1
+                """,
+                (now, self.max_attempts)
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+
+            connection.execute(
+                "UPDATE shards SET status = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE shard_id = ?",
+                (owner, now + lease_seconds, row[0])
+            )
+            connection.execute("COMMIT")
+        return Shard(row[0], self.shard_count, row[1] + 1)
+
+    def renew(self, shard_id: int, owner: str, lease_seconds: float) -> bool:
+        '''
+        Extiende el lease de un shard. Retorna False si el shard ya no es de owner.
+        '''
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE shards SET lease_until = ? WHERE shard_id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + lease_seconds, shard_id, owner)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, shard_id: int, owner: str):
+        '''
+        Devuelve un shard que no se pudo procesar, para reintentarlo (o lo marca como
+        fallido si ya agotó los intentos).
+        '''
+        with closing(self._connect()) as connection:
+            connection.execute(
+                """
+                UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    owner = NULL, lease_until = 0
+                WHERE shard_id = ? AND owner = ? AND status = 'leased'
+                """,
+                (self.max_attempts, shard_id, owner)
+            )
+
+    def complete(self, shard_id: int, owner: str, counters: Dict[str, int]) -> bool:
+        '''
+        Marca un shard como terminado, con sus contadores. Retorna False si el lease se
+        perdió mientras se procesaba (otro worker lo retomó y su resultado es el que vale).
+        '''
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                """
+                UPDATE shards SET status = 'done', lease_until = 0, rows = ?, blocks = ?,
+                    repairs_attempted = ?, repairs_successful = ?, mistypes = ?
+                WHERE shard_id = ? AND owner = ? AND status = 'leased'
+                """,
+                (counters["rows"], counters["blocks"], counters["attempts"], counters["successful"],
+                 counters["mistypes"], shard_id, owner)
+            )
+            return cursor.rowcount == 1
+
+    def status(self) -> Dict[str, int]:
+        '''
+        Cantidad de shards por estado.
+        '''
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return dict(rows)
+
+    def unfinished(self) -> int:
+        '''
+        Shards que todavía se pueden procesar (pendientes o con lease, vigente o vencido).
+        '''
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM shards WHERE status IN ('pending', 'leased') AND attempts < ?",
+                (self.max_attempts,)
+            ).fetchone()[0]
+
+    def done_shards(self) -> List[int]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT shard_id FROM shards WHERE status = 'done' ORDER BY shard_id").fetchall()
+        return [row[0] for row in rows]
+
+    def totals(self) -> Dict[str, int]:
+        '''
+        Contadores sumados de todos los shards terminados.
+        '''
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                """
+                SELECT COALESCE(SUM(rows), 0), COALESCE(SUM(blocks), 0), COALESCE(SUM(repairs_attempted), 0),
+                    COALESCE(SUM(repairs_successful), 0), COALESCE(SUM(mistypes), 0)
+                FROM shards WHERE status = 'done'
+                """
+            ).fetchone()
+        return dict(zip(COUNTERS, row))
+
+
+class LeaseHeartbeat():
+    '''
+    Hilo que renueva el lease de un shard cada tercio de su duración mientras se procesa.
+    Los errores transitorios de la base (por ejemplo, "database is locked") se reintentan
+    en la vuelta siguiente. El lease se da por perdido si otro worker lo tomó o si no se
+    pudo renovar antes de que venciera; check() lanza LeaseLost en ese caso.
+    '''
+
+    def __init__(self, store: ShardStore, shard: Shard, owner: str, lease_seconds: float):
+        self.store = store
+        self.shard = shard
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._renewed = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{shard.shard_id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except sqlite3.Error as e:
+                print(f"No fue posible renovar el lease del shard {self.shard.shard_id}, se reintentará: {e}")
+            if self.lost:
+                print(f"Se perdió el lease del shard {self.shard.shard_id}")
+                return
+
+    def renew(self):
+        '''
+        Renueva el lease de inmediato. Marca el lease como perdido si ya no es de este worker.
+        '''
+        started = time.monotonic()
+        if self.store.renew(self.shard.shard_id, self.owner, self.lease_seconds):
+            self._renewed = started
+        else:
+            self.lost = True
+
+    def check(self):
+        '''
+        Lanza LeaseLost si el lease se perdió, o si venció sin poder renovarlo.
+        '''
+        if not self.lost and time.monotonic() - self._renewed >= self.lease_seconds:
+            self.lost = True
+        if self.lost:
+            raise LeaseLost(f"Se perdió el lease del shard {self.shard.shard_id}")
+
+    def confirm(self):
+        '''
+        Renueva el lease y verifica que sigue siendo de este worker, antes de escribir un resultado.
+        '''
+        self.renew()
+        self.check()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+@dataclass
+class ShardConfig(RunConfig):
+    '''
+    Configuración de un proceso de shards: la común (ver RunConfig) más la de los shards.
+    '''
+    db_path: str
+    shard_dir: str
+    shard_size: int
+    lease_seconds: float
+    max_attempts: int
+
+    @classmethod
+    def from_env(cls) -> "ShardConfig":
+        config = RunConfig.from_env()
+        return cls(
+            **asdict(config),
+            db_path=os.getenv("SHARD_DB", f"{config.file_name}.shards.sqlite"),
+            shard_dir=os.getenv("SHARD_DIR", f"{config.file_name}.shards"),
+            shard_size=int(os.getenv("SHARD_SIZE", "1000")),
+            lease_seconds=float(os.getenv("SHARD_LEASE_SECONDS", "300")),
+            max_attempts=int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+        )
+
+
+def _shard_path(config: ShardConfig, shard_id: int, suffix: str) -> str:
+    return os.path.join(config.shard_dir, f"shard_{shard_id:05d}{suffix}")
+
+
+def read_shard_rows(shard: Shard, config: ShardConfig) -> pd.DataFrame:
+    '''
+    Lee las filas de los comercios del shard (por trozos, si la entrada es CSV o Parquet),
+    con la numeración global de filas en el índice.
+    '''
+    parts = []
+    for chunk in read_input(config.file_name, config.chunk_size):
+        in_shard = chunk["Comercio"].astype(str).map(lambda comercio_id: shard_of(comercio_id, shard.shard_count)) == shard.shard_id
+        parts.append(chunk.loc[in_shard])
+    return prepare_chunk(pd.concat(parts))
+
+
+def process_shard(shard: Shard, config: ShardConfig, heartbeat: Optional[LeaseHeartbeat] = None) -> Dict[str, int]:
+    '''
+    Procesa las filas de un shard por bloques, como main, y escribe sus columnas de
+    resultado a un archivo propio del shard. Cada shard tiene su journal, así que un
+    shard retomado después de una caída no repite los comercios ya procesados; y como
+    cada comercio está en un solo shard, tampoco se repite entre shards.
+
+    Si se entrega el heartbeat del lease, antes de cada bloque y antes de escribir el
+    resultado se verifica que el lease siga vigente (si no, se lanza LeaseLost), para no
+    crear contratos ni escribir archivos de un shard que ya procesa otro worker.
+    '''
+    # Las filas del shard no son contiguas: se procesan con numeración propia (los bloques
+    # se identifican por fila) y al final se recupera la numeración global
+    df = read_shard_rows(shard, config)
+    rows = df.index
+    df = df.reset_index(drop=True)
+    journal = Journal(_shard_path(config, shard.shard_id, ".journal.jsonl"), resume=True)
+    journal.apply_to(df)
+
+    log_file = _shard_path(config, shard.shard_id, ".log")
+    with open(log_file, "a") as f:
+        f.write(f"Shard {shard.shard_id} de {shard.shard_count}: {len(df)} filas (intento {shard.attempts})\n")
+
+    counters = dict.fromkeys(COUNTERS, 0)
+    try:
+        for start in range(0, len(df), config.block_size):
+            if heartbeat is not None:
+                heartbeat.check()
+            end = min(start + config.block_size, len(df))
+            attempts, successful, mistypes = process_block(
+                df, start, end, config.endpoint_1, config.endpoint_2, config.headers_1, config.headers_2,
+                log_file, config.block_size, config.max_workers, config.batch_size, journal
+            )
+            counters["rows"] += end - start
+            counters["blocks"] += 1
+            counters["attempts"] += attempts
+            counters["successful"] += successful
+            counters["mistypes"] += mistypes
+    finally:
+        journal.close()
+    df.index = rows
+
+    # Escribir el resultado de forma atómica (un shard terminado siempre tiene su archivo
+    # completo), y solo si el lease sigue siendo de este worker
+    result_file = _shard_path(config, shard.shard_id, ".csv")
+    temp_file = f"{result_file}.{heartbeat.owner if heartbeat is not None else os.getpid()}.tmp"
+    df.loc[:, list(RESULT_COLUMNS)].to_csv(temp_file, index_label="Fila")
+    try:
+        if heartbeat is not None:
+            heartbeat.confirm()
+    except (LeaseLost, sqlite3.Error):
+        os.remove(temp_file)
+        raise
+    os.replace(temp_file, result_file)
+    return counters
+
+
+def run_worker(config: Optional[ShardConfig] = None, owner: Optional[str] = None) -> int:
+    '''
+    Procesa shards hasta que no quede ninguno. Si no hay shards libres pero otros workers
+    tienen leases vigentes, espera por si alguno se cae y su shard queda disponible.
+    Retorna la cantidad de shards terminados por este worker.
+    '''
+    config = config or ShardConfig.from_env()
+    owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+    store = ShardStore(config.db_path, config.max_attempts)
+    os.makedirs(config.shard_dir, exist_ok=True)
+
+    completed = 0
+    while True:
+        shard = store.lease(owner, config.lease_seconds)
+        if shard is None:
+            if store.unfinished() == 0:
+                break
+            time.sleep(min(5.0, config.lease_seconds / 3))
+            continue
+
+        print(f"Worker {owner}: procesando shard {shard.shard_id} de {shard.shard_count}")
+        try:
+            with LeaseHeartbeat(store, shard, owner, config.lease_seconds) as heartbeat:
+                counters = process_shard(shard, config, heartbeat)
+        except LeaseLost as e:
+            # El shard ya no es de este worker: no se libera ni se completa
+            print(f"Worker {owner}: {e}, se abandona el shard")
+            continue
+        except Exception as e:
+            print(f"Worker {owner}: error en el shard {shard.shard_id}: {e}")
+            store.release(shard.shard_id, owner)
+            continue
+
+        if store.complete(shard.shard_id, owner, counters):
+            completed += 1
+        else:
+            print(f"Worker {owner}: el shard {shard.shard_id} fue retomado por otro worker, se descarta este resultado")
+
+    close_sessions()
+    shutdown()
+    print(f"Worker {owner}: {completed} shards terminados")
+    return completed
+
+
+def _worker_process(number):
+    run_worker(owner=f"{socket.gethostname()}-{os.getpid()}-{number}")
+
+
+def merge(config: Optional[ShardConfig] = None):
+    '''
+    Une los resultados de los shards terminados en un solo archivo de resultado (igual que
+    main: el Excel se reescribe, CSV y Parquet se escriben a OUTPUT_FILE), junta sus
+    journals en JOURNAL_FILE y sus logs en LOG_FILE, e informa los contadores totales.
+    '''
+    config = config or ShardConfig.from_env()
+    store = ShardStore(config.db_path, config.max_attempts)
+    status = store.status()
+    done = store.done_shards()
+
+    frames = [
+        pd.read_csv(
+            _shard_path(config, shard_id, ".csv"),
+            index_col="Fila",
+            dtype={"Contrato": str, "Similitud": "float64", "Nivel": "string", "Plantilla": "string"}
+        )
+        for shard_id in done
+    ]
+    results = pd.concat(frames) if frames else pd.DataFrame(columns=list(RESULT_COLUMNS))
+
+    def apply_results(df):
+        rows = results.index.intersection(df.index)
+        for column in RESULT_COLUMNS:
+            df.loc[rows, column] = results.loc[rows, column]
+
+    writer = OutputWriter(config.file_name, config.output_file)
+    for df in read_input(config.file_name, config.chunk_size):
+        apply_results(df)
+        writer.write(df)
+    writer.close()
+
+    # Juntar los journals de los shards en JOURNAL_FILE, como el de main (cada comercio está
+    # en un solo shard), para poder seguir con main --resume o con la reparación en dos fases
+    temp_file = f"{config.journal_file}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as combined:
+        for shard_id in done:
+            journal_file = _shard_path(config, shard_id, ".journal.jsonl")
+            if os.path.exists(journal_file):
+                with open(journal_file, "r", encoding="utf-8") as f:
+                    shutil.copyfileobj(f, combined)
+    os.replace(temp_file, config.journal_file)
+
+    # Juntar los logs de los shards, en orden
+    with open(config.log_file, "w") as log:
+        for shard_id in done:
+            log_file = _shard_path(config, shard_id, ".log")
+            if os.path.exists(log_file):
+                with open(log_file, "r") as f:
+                    log.write(f.read())
+
+        totals = store.totals()
+        complete = len(done) == sum(status.values())
+        final_message = "Todos los registros se procesaron" if complete else f"Proceso incompleto, shards por estado: {status}"
+        log.write(f"{final_message}\nBloques totales: {totals['blocks']}, Total de filas analizadas: {totals['rows']}, Total de intentos de reparación: {totals['attempts']}, Total reparados: {totals['successful']}, Total mal clasificados: {totals['mistypes']}\n")
+
+    print(final_message)
+    print(f"Shards: {len(done)} de {sum(status.values())} terminados")
+    print(f"Bloques totales: {totals['blocks']}, Total filas analizadas: {totals['rows']}, Total intentos de reparación: {totals['attempts']}, Total reparaciones exitosas: {totals['successful']}, Total de casos mal clasificados: {totals['mistypes']}")
+
+
+def coordinate(workers: int, reset: bool = False):
+    '''
+    Divide la lista en shards (si no estaba dividida, o con reset), los procesa con
+    workers en procesos locales y une los resultados. Los comercios se reparten por
+    ID, en tantos shards como hagan falta para que tengan unas SHARD_SIZE filas.
+    '''
+    config = ShardConfig.from_env()
+    store = ShardStore(config.db_path, config.max_attempts)
+
+    if reset or store.file_name != config.file_name:
+        shutil.rmtree(config.shard_dir, ignore_errors=True)
+        total_rows = count_input_rows(config.file_name)
+        shard_count = max(1, -(-total_rows // config.shard_size))
+        store.create(config.file_name, shard_count)
+        print(f"{total_rows} filas divididas por comercio en {shard_count} shards de unas {config.shard_size} filas")
+    else:
+        print(f"Retomando shards existentes: {store.status()}")
+
+    # Procesos con "spawn": cada worker carga su propio modelo y sus propias conexiones
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_worker_process, args=(number,), name=f"shard-worker-{number}") for number in range(workers)]
+    for process in processes:
+        process.start()
+
+    while any(process.is_alive() for process in processes):
+        for process in processes:
+            process.join(timeout=10)
+        print(f"Shards por estado: {store.status()}")
+
+    merge(config)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revisión de contratos repartida en shards entre varios procesos o máquinas")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinate_parser = subparsers.add_parser("coordinate", help="dividir la lista, procesarla con N workers locales y unir los resultados")
+    coordinate_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    coordinate_parser.add_argument("--reset", action="store_true", help="volver a dividir la lista, descartando los shards anteriores")
+    subparsers.add_parser("work", help="sumarse como worker a shards ya creados (por ejemplo, desde otra máquina)")
+    subparsers.add_parser("merge", help="unir los resultados de los shards terminados")
+    subparsers.add_parser("status", help="mostrar la cantidad de shards por estado")
+
+    args = parser.parse_args(argv)
+    if args.command == "coordinate":
+        coordinate(args.workers, args.reset)
+    elif args.command == "work":
+        run_worker()
+    elif args.command == "merge":
+        merge()
+    else:
+        config = ShardConfig.from_env()
+        print(ShardStore(config.db_path, config.max_attempts).status())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List
+
+from compare import shutdown
+from correccion_contratos import classify_merchant, new_merchant_result, record_verified, repair_merchant, score_pending_results
+from http_client import RateLimiter, close_sessions, concurrency_summary
+from input_files import OutputWriter, read_input
+from journal import Journal
+from metrics import get_metrics, show
+from run_config import RunConfig
+from verified_index import get_verified_index
+
+
+@dataclass
+class PhaseConfig(RunConfig):
+    '''
+    Configuración de la ejecución en dos fases: la común (ver RunConfig) más la de cada fase.
+    '''
+    plan_file: str
+    classify_workers: int
+    repair_workers: int
+    repair_rate: float
+
+    @classmethod
+    def from_env(cls) -> "PhaseConfig":
+        config = RunConfig.from_env()
+        return cls(
+            **asdict(config),
+            plan_file=os.getenv("PLAN_FILE", f"{config.file_name}.plan.json"),
+            # La clasificación solo lee, así que puede ir con mucha más concurrencia que la reparación
+            classify_workers=int(os.getenv("CLASSIFY_WORKERS", "8")),
+            repair_workers=int(os.getenv("REPAIR_WORKERS", "2")),
+            # Creaciones de contrato por segundo (0 = sin límite)
+            repair_rate=float(os.getenv("REPAIR_RATE", "1"))
+        )
+
+
+def configure_sessions(config: PhaseConfig):
+    '''
+    Dimensiona las sesiones HTTP (conexiones por endpoint y, con ello, el máximo del límite
+    de concurrencia adaptativo) para los hilos de las fases, salvo que HTTP_POOL_SIZE esté
+    definido. Se debe llamar antes de crear las sesiones.
+    '''
+    os.environ.setdefault("HTTP_POOL_SIZE", str(max(10, config.classify_workers, config.repair_workers)))
+
+
+def _run_merchants(
+    comercio_ids: List[str],
+    work: Callable,
+    executor: ThreadPoolExecutor,
+    config: PhaseConfig,
+    journal: Journal
+) -> list:
+    '''
+    Procesa los comercios en grupos de BLOCK_SIZE con el pool de hilos: compara en lote los
+    contratos descargados del grupo, registra cada resultado en el journal (salvo los que
+    quedan pendientes de reparar o cuya consulta falló, que se vuelven a revisar al
+    retomar) y escribe los mensajes del grupo al log.
+    '''
+    results = []
+    for start in range(0, len(comercio_ids), config.block_size):
+        group = list(executor.map(work, comercio_ids[start:start + config.block_size]))
+        if config.batch_size > 0:
+            score_pending_results(group, config.batch_size)
+        record_verified(group)
+
+        log_entries = []
+        for result in group:
+            if result.outcome not in ("sin_contrato", "error_consulta"):
+                journal.append(result.comercio_id, result.contrato, result.similitud, result.outcome, result.nivel, result.plantilla)
+            log_entries.extend(result.log_entries)
+        summary = concurrency_summary()
+        if summary:
+            log_entries.append(summary)
+        with open(config.log_file, "a") as f:
+            f.write("\n".join(log_entries) + "\n")
+        results.extend(group)
+    return results
+
+
+def save_plan(config: PhaseConfig, missing: List[str], counts: Dict[str, int]):
+    '''
+    Guarda de forma atómica la lista de comercios sin contrato que quedan para la fase de reparación.
+    '''
+    plan = {
+        "file_name": config.file_name,
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "counts": counts,
+        "missing": missing
+    }
+    temp_file = f"{config.plan_file}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=2)
+    os.replace(temp_file, config.plan_file)
+
+
+def load_plan(config: PhaseConfig) -> dict:
+    with open(config.plan_file, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("file_name") != config.file_name:
+        raise ValueError(f"El plan {config.plan_file} corresponde a otro archivo de entrada: {plan.get('file_name')}")
+    return plan
+
+
+def write_output(config: PhaseConfig, journal: Journal):
+    '''
+    Copia los resultados del journal a la salida, igual que main: el Excel se reescribe,
+    CSV y Parquet se escriben a OUTPUT_FILE.
+    '''
+    writer = OutputWriter(config.file_name, config.output_file)
+    for df in read_input(config.file_name, config.chunk_size):
+        journal.apply_to(df)
+        writer.write(df)
+    writer.close()
+
+
+def classify(config: PhaseConfig, resume: bool = False) -> dict:
+    '''
+    Fase 1: clasifica todos los comercios sin contrato declarado solo con llamadas de
+    lectura (chequeo y validación del archivo), con CLASSIFY_WORKERS en paralelo.
+    Los comercios con contrato quedan registrados en el journal; los que no tienen
+    contrato se guardan en el plan para la fase de reparación.
+    '''
+    configure_sessions(config)
+    journal = Journal(config.journal_file, resume=resume)
+    with open(config.log_file, "a" if resume else "w") as f:
+        f.write(f"Fase de clasificación. Comercios en paralelo: {config.classify_workers}\n")
+
+    def work(comercio_id):
+        with get_metrics().merchant():
+            return classify_merchant(comercio_id, config.endpoint_1, config.headers_1, config.batch_size > 0)
+
+    missing = []
+    counts = {"rows": 0, "merchants": 0, "verified": 0, "mistypes": 0, "download_errors": 0, "listing_errors": 0, "missing": 0}
+    seen = set()
+    verified_index = get_verified_index()
+    with ThreadPoolExecutor(max_workers=config.classify_workers) as executor:
+        for df in read_input(config.file_name, config.chunk_size):
+            get_metrics().add_rows(len(df))
+            counts["rows"] += len(df)
+
+            # Comercios sin contrato declarado, sin repetir IDs ni los ya registrados en el journal
+            candidates = df.loc[df["Contrato"] != "Si", "Comercio"].astype(str).unique()
+            pending = [comercio_id for comercio_id in candidates if comercio_id not in seen and not journal.has(comercio_id)]
+            seen.update(pending)
+
+            # Los comercios con una verificación vigente de otra ejecución no se consultan:
+            # su resultado se copia al journal, desde donde se escribe la salida
+            if verified_index is not None:
+                verified = verified_index.fresh(pending)
+                for comercio_id, entry in verified.items():
+                    journal.append(comercio_id, "Si", entry["similitud"], "verificado", entry["nivel"], entry["plantilla"])
+                counts["verified"] += len(verified)
+                pending = [comercio_id for comercio_id in pending if comercio_id not in verified]
+
+            for result in _run_merchants(pending, work, executor, config, journal):
+                counts["merchants"] += 1
+                if result.outcome == "mal_clasificado":
+                    counts["mistypes"] += 1
+                elif result.outcome == "error_descarga":
+                    counts["download_errors"] += 1
+                elif result.outcome == "error_consulta":
+                    counts["listing_errors"] += 1
+                elif result.repair:
+                    counts["missing"] += 1
+                    missing.append(result.comercio_id)
+
+    save_plan(config, missing, counts)
+    write_output(config, journal)
+    journal.close()
+
+    with open(config.log_file, "a") as f:
+        f.write(f"Clasificación terminada. Filas: {counts['rows']}, comercios consultados: {counts['merchants']}, ya verificados: {counts['verified']}, mal clasificados: {counts['mistypes']}, errores de descarga: {counts['download_errors']}, errores de consulta: {counts['listing_errors']}, sin contrato: {counts['missing']}\n")
+    print(f"Clasificación terminada. Filas: {counts['rows']}, comercios consultados: {counts['merchants']}, ya verificados: {counts['verified']}, mal clasificados: {counts['mistypes']}, errores de descarga: {counts['download_errors']}, errores de consulta: {counts['listing_errors']}, sin contrato (a reparar): {counts['missing']}")
+    print(f"Plan guardado en {config.plan_file}")
+    if counts["listing_errors"]:
+        print(f"{counts['listing_errors']} comercios no se pudieron consultar: volver a ejecutar classify --resume para revisarlos")
+    return counts
+
+
+def repair(config: PhaseConfig) -> dict:
+    '''
+    Fase 2: crea los contratos de los comercios del plan, con REPAIR_WORKERS en paralelo y
+    como máximo REPAIR_RATE creaciones por segundo. Se puede volver a ejecutar: los
+    comercios ya reparados (según el journal) se omiten y los fallidos se reintentan.
+    Antes de crear cada contrato se vuelve a consultar si ya existe: el plan puede estar
+    desactualizado, y en un reintento la creación anterior pudo haber funcionado aunque
+    fallara la verificación (o el proceso se cayera antes de registrarla).
+    '''
+    configure_sessions(config)
+    plan = load_plan(config)
+    journal = Journal(config.journal_file, resume=True)
+    limiter = RateLimiter(config.repair_rate)
+    with open(config.log_file, "a") as f:
+        f.write(f"Fase de reparación. Comercios en paralelo: {config.repair_workers}, creaciones por segundo: {config.repair_rate or 'sin límite'}\n")
+
+    pending = [
+        comercio_id for comercio_id in plan["missing"]
+        if journal.entries.get(comercio_id, {}).get("outcome") != "reparado"
+    ]
+    print(f"Comercios a reparar: {len(pending)} de {len(plan['missing'])} en el plan")
+
+    def work(comercio_id):
+        with get_metrics().merchant():
+            result = new_merchant_result(comercio_id)
+            result.repair = True
+            show(f"Reparando comercio {comercio_id}...", end=" ")
+            return repair_merchant(
+                result, config.endpoint_1, config.endpoint_2, config.headers_1, config.headers_2,
+                config.batch_size > 0, limiter, check_first=True
+            )
+
+    counts = {"attempts": 0, "successful": 0, "listing_errors": 0}
+    with ThreadPoolExecutor(max_workers=config.repair_workers) as executor:
+        for result in _run_merchants(pending, work, executor, config, journal):
+            if result.outcome == "error_consulta":
+                counts["listing_errors"] += 1
+                continue
+            counts["attempts"] += 1
+            if result.outcome == "reparado":
+                counts["successful"] += 1
+
+    write_output(config, journal)
+    journal.close()
+
+    with open(config.log_file, "a") as f:
+        f.write(f"Reparación terminada. Total de intentos de reparación: {counts['attempts']}, Total reparados: {counts['successful']}\n")
+    print(f"Reparación terminada. Total intentos de reparación: {counts['attempts']}, Total reparaciones exitosas: {counts['successful']}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Revisión de contratos en dos fases: clasificación de solo lectura y luego reparación con límite de tasa"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    classify_parser = subparsers.add_parser("classify", help="clasificar los comercios y guardar el plan de reparación")
+    classify_parser.add_argument("--resume", action="store_true", help="omitir los comercios ya registrados en el journal")
+    subparsers.add_parser("repair", help="reparar los comercios del plan guardado (se puede repetir)")
+    run_parser = subparsers.add_parser("run", help="clasificar y luego reparar")
+    run_parser.add_argument("--resume", action="store_true", help="omitir los comercios ya registrados en el journal")
+
+    args = parser.parse_args(argv)
+    config = PhaseConfig.from_env()
+
+    # Métricas del proceso, igual que en main
+    metrics = config.start_metrics()
+
+    try:
+        if args.command in ("classify", "run"):
+            classify(config, args.resume)
+        if args.command in ("repair", "run"):
+            repair(config)
+    finally:
+        close_sessions()
+        shutdown()
+        config.stop_metrics()
+
+    snapshot = metrics.snapshot()
+    print(f"Filas por segundo: {snapshot['rows_per_second']:.2f}, Comercios procesados: {snapshot['merchants']}, Máximo en paralelo: {snapshot['max_in_flight']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Iterable, Optional
+from dotenv import load_dotenv
+
+
+class VerifiedIndex():
+    '''
+    Índice persistente (SQLite) de los comercios cuyo contrato ya fue verificado: se
+    descargó y se comparó con el ejemplo. Guarda la fecha de verificación, el coeficiente
+    de similitud (con su nivel y plantilla) y el nombre del archivo del contrato.
+
+    Mientras una entrada tenga menos de ttl_seconds, el comercio se da por verificado en
+    las ejecuciones siguientes sin llamar a los servicios ni al modelo, aunque la planilla
+    lo traiga sin contrato declarado. Se puede compartir entre procesos (shards).
+    '''
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS verified (
+            comercio TEXT PRIMARY KEY,
+            verified_at REAL NOT NULL,
+            similitud REAL,
+            nivel TEXT,
+            plantilla TEXT,
+            nombre_archivo TEXT
+        );
+    """
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        with closing(self._connect()) as connection:
+            # WAL permite leer mientras otro proceso escribe
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+
+    def _connect(self):
+        # Una conexión por operación: se puede usar desde varios hilos y procesos
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def record(self, entries: Iterable[dict]):
+        '''
+        Registra (o renueva) la verificación de los comercios, en una sola transacción.
+        Cada entrada tiene "comercio", "similitud", "nivel", "plantilla" y "nombre_archivo".
+        '''
+        now = time.time()
+        rows = [
+            (str(entry["comercio"]), now, entry.get("similitud"), entry.get("nivel"), entry.get("plantilla"), entry.get("nombre_archivo"))
+            for entry in entries
+        ]
+        if not rows:
+            return
+
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO verified (comercio, verified_at, similitud, nivel, plantilla, nombre_archivo) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            connection.execute("COMMIT")
+
+    def fresh(self, comercio_ids: Iterable[str]) -> Dict[str, dict]:
+        '''
+        Retorna las entradas vigentes (más recientes que el TTL) de los comercios indicados.
+        '''
+        comercio_ids = [str(comercio_id) for comercio_id in comercio_ids]
+        oldest = time.time() - self.ttl_seconds
+        entries = {}
+
+        with closing(self._connect()) as connection:
+            # Consultar en grupos, para no pasar el máximo de parámetros de SQLite
+            for start in range(0, len(comercio_ids), 500):
+                group = comercio_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in group)
+                cursor = connection.execute(
+                    f"SELECT comercio, verified_at, similitud, nivel, plantilla, nombre_archivo FROM verified "
+                    f"WHERE verified_at >= ? AND comercio IN ({placeholders})",
+                    [oldest, *group]
+                )
+                for comercio, verified_at, similitud, nivel, plantilla, nombre_archivo in cursor:
+                    entries[comercio] = {
+                        "comercio": comercio,
+                        "verified_at": verified_at,
+                        "similitud": similitud,
+                        "nivel": nivel,
+                        "plantilla": plantilla,
+                        "nombre_archivo": nombre_archivo
+                    }
+        return entries
+
+    def apply_to(self, df, rows) -> Dict[str, dict]:
+        '''
+        Marca con contrato (y copia el coeficiente, nivel y plantilla) las filas indicadas
+        cuyos comercios tienen una verificación vigente. Retorna esas entradas.
+        '''
+        comercios = df.loc[rows, "Comercio"].astype(str)
+        entries = self.fresh(comercios.unique())
+        comercios = comercios[comercios.isin(entries)]
+        if comercios.empty:
+            return entries
+
+        df.loc[comercios.index, "Contrato"] = "Si"
+        columns = (("Similitud", "similitud"), ("Nivel", "nivel"), ("Plantilla", "plantilla"))
+        for column, key in columns:
+            values = comercios.map(lambda comercio_id: entries[comercio_id].get(key)).dropna()
+            if not values.empty:
+                df.loc[values.index, column] = values
+        return entries
+
+
+def verified_date(entry: dict) -> str:
+    return datetime.datetime.fromtimestamp(entry["verified_at"]).isoformat(timespec="seconds")
+
+
+_index_instance: Optional[VerifiedIndex] = None
+_index_lock = threading.Lock()
+
+def get_verified_index() -> Optional[VerifiedIndex]:
+    '''
+    Retorna el índice de comercios verificados compartido, o None si VERIFIED_INDEX no está
+    definido. La vigencia de cada verificación se toma de VERIFIED_TTL_DAYS (por defecto 30).
+    '''
+    global _index_instance
+
+    if _index_instance is None:
+        with _index_lock:
+            if _index_instance is None:
+                load_dotenv()
+                path = os.getenv("VERIFIED_INDEX")
+                if not path:
+                    return None
+                ttl_days = float(os.getenv("VERIFIED_TTL_DAYS", "30"))
+                _index_instance = VerifiedIndex(path, ttl_days * 24 * 3600)
+
+    return _index_instance